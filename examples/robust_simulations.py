@@ -15,26 +15,19 @@ def robust_simulations():
     )
     generate_BCD_and_zero_initialization(sys)
 
-    synthesizer = SLS (
-        system_model = sys,
-        FIR_horizon = 10
-    )
-    # set objective
-    obj_H2 = SLS_Obj_H2 ()
-    synthesizer << obj_H2
-
-    # add constraints
-    # robustness constraint should be added before dlocalized as it modifies the SLS constriants
-    robust = SLS_Cons_Robust (
-        gamma_coefficient = 10e3
-    )
-    synthesizer << robust
-
-    dlocalized = SLS_Cons_dLocalized (
-        act_delay = 1,
-        d = 6
+    # the synthesizer holds cvxpy objects, so the sweep describes it declaratively
+    # and each worker process rebuilds it for its grid points
+    spec = Sweep_Spec (
+        system = sys,
+        synthesis_kwargs = {'FIR_horizon': 10},
+        components = [
+            ('H2', SLS_Obj_H2, {}),
+            # robustness constraint should be added before dlocalized as it modifies the SLS constriants
+            ('robust', SLS_Cons_Robust, {'gamma_coefficient': 10e3}),
+            ('dlocalized', SLS_Cons_dLocalized, {'act_delay': 1, 'd': 6})
+        ],
+        keep_controllers = True
     )
-    synthesizer += dlocalized
 
     sim_horizon = 25
     # generate noise
@@ -51,22 +44,41 @@ def robust_simulations():
     comm_speeds = [2, 1.5, 1.4, 1.3, 1.2, 1.1, 1, 0.9, 0.8, 0.7, 0.6, 0.5, 0.4]
     cPrints = [2, 1, 0.4]  # which comm speeds to simulate & plot
 
-    clnorms     = []
-    robust_stabs = []
-    for comm_speed in comm_speeds:
-        dlocalized._comm_speed = comm_speed
-        controller = synthesizer.synthesizeControllerModel()
-
-        clnorms.append(obj_H2.getObjectiveValue())
-        robust_stabs.append(robust.getStabilityMargin())
+    results = run_sweep (
+        spec = spec,
+        grid = parameter_grid(**{'dlocalized.comm_speed': comm_speeds})
+    )
 
-        if comm_speed in cPrints:
-            # run the simulation
-            simulator.setController (controller=controller)
-            x_history, _, _, u_history, _ = simulator.run ()
+    clnorms      = [result['objective_values']['H2'] for result in results]
+    robust_stabs = [result['stability_margins']['robust'] for result in results]
+    # simulate the printed controllers side by side on the same noise
+    printed = [(comm_speed, result['controller']) for comm_speed, result in zip(comm_speeds, results) if comm_speed in cPrints]
+    histories = simulator.runControllers (controllers=[controller for _, controller in printed])
+    for (comm_speed, _), (x_history, _, _, u_history, _) in zip(printed, histories):
+        Bu_history = matrix_list_multiplication(sys._B2,u_history)
+        plot_heat_map(x_history, Bu_history, 'Comms = %d' % comm_speed)
 
-            Bu_history = matrix_list_multiplication(sys._B2,u_history)
-            plot_heat_map(x_history, Bu_history, 'Comms = %d' % comm_speed)
+    # Monte Carlo check of the robust designs against perturbed plants, all members simulated at once
+    members = 200
+    ensemble = generate_perturbed_ensemble (
+        system_model = sys,
+        members = members,
+        A_perturbation = 0.01,
+        random_seed = 0
+    )
+    for comm_speed, controller in printed:
+        cost = Running_Cost ()
+        Simulator (
+            system = ensemble,
+            controller = controller,
+            noise = GaussianNoise (Nw = sys._Nw),
+            horizon = 100,
+            trajectories = members
+        ).run (aggregators = [cost])
+        print('Comms = %s, median and worst per-step cost over the ensemble:' % comm_speed, cost.getCostQuantiles((0.5, 1)))
+        # the empirical counterpart of the stability margin of SLS_Cons_Robust
+        screen = screen_closed_loop_stability (system_model = ensemble, controller = controller)
+        print('Comms = %s, stable fraction %.3f, worst margin %.3f' % (comm_speed, screen['stable_fraction'], screen['worst_margin']))
 
     plot_line_chart(
         list_x=comm_speeds,
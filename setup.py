@@ -34,6 +34,7 @@ setup(
     install_requires=[
         'setuptools',
         'numpy',
+        'scipy',
         'cvxpy',
         'matplotlib'
     ],
@@ -1,7 +1,13 @@
 from .core import *
+from .convolution import *
+from .random_streams import *
 from .system_models import *
 from .controller_models import *
 from .noise_models import *
+from .closed_loop_models import *
+from .shared_arrays import *
+from .recorders import *
+from .aggregators import *
 from .tools import *
 
 # Synthesis algorithms and their corresponding files
@@ -0,0 +1,218 @@
+from .core import ObjBase
+import numpy as np
+'''
+Online statistics of the simulated signals, updated step by step by Simulator.run(aggregators=[...])
+so that no history is kept.
+
+To create a new aggregator, inherit the following base function and customize the specified methods.
+
+class Aggregator:
+    def __init__ (self, signal='x'):
+    def initialize (self, trajectories=None):
+        # reset the statistics
+    def aggregate (self, value):
+        # value is the (N,K) signal at the current time step, K = 1 if not batched
+'''
+
+class Aggregator (ObjBase):
+    '''
+    The base class of the online statistics of one signal: 'x', 'y', 'z', 'u', or 'w'
+    '''
+    _signals = ('x', 'y', 'z', 'u', 'w')
+
+    def __init__ (self, signal='x'):
+        self._signal = signal
+        self._index = self._signals.index(signal)
+        self._trajectories = 1
+        self._t = 0 # the number of the time steps seen
+
+    def initialize (self, trajectories=None):
+        self._trajectories = 1 if trajectories is None else trajectories
+        self._t = 0
+
+    def update (self, x=None, y=None, z=None, u=None, w=None):
+        # called by the simulator at each time step
+        value = (x, y, z, u, w)[self._index]
+        self._t += 1
+        if value is None:
+            return
+        if value.shape[1] != self._trajectories:
+            # a signal shared by all trajectories
+            value = np.broadcast_to(value, (value.shape[0], self._trajectories))
+        self.aggregate(value)
+
+    def aggregate (self, value):
+        pass
+
+    def getSteps (self):
+        return self._t
+
+
+class Signal_Statistics (Aggregator):
+    '''
+    The mean and variance (Welford) and the peak magnitude of each component of a signal,
+    over the time steps and the trajectories
+    '''
+    def initialize (self, trajectories=None):
+        Aggregator.initialize(self, trajectories=trajectories)
+        self._count = 0
+        self._mean = None
+        self._M2 = None
+        self._peak = None # (N,K), the peak magnitude of each trajectory
+
+    def aggregate (self, value):
+        # merge the K samples of this step into the running moments (Chan et al.)
+        samples = value.shape[1]
+        sample_mean = np.mean(value, axis=1)
+        sample_M2 = np.sum(np.square(value - sample_mean[:,np.newaxis]), axis=1)
+        magnitude = np.absolute(value)
+        if self._count == 0:
+            self._mean = sample_mean
+            self._M2 = sample_M2
+            self._peak = magnitude.copy()
+        else:
+            count = self._count + samples
+            delta = sample_mean - self._mean
+            self._mean = self._mean + delta * (samples / count)
+            self._M2 = self._M2 + sample_M2 + np.square(delta) * (self._count * samples / count)
+            np.maximum(self._peak, magnitude, out=self._peak)
+        self._count += samples
+
+    def getCount (self):
+        return self._count
+
+    def getMean (self):
+        return self._mean
+
+    def getVariance (self, ddof=0):
+        if self._count <= ddof:
+            return None
+        return self._M2 / (self._count - ddof)
+
+    def getStandardDeviation (self, ddof=0):
+        variance = self.getVariance(ddof=ddof)
+        return None if variance is None else np.sqrt(variance)
+
+    def getPeak (self, per_trajectory=False):
+        # the peak magnitude of each component, (N,) or (N,K) if per_trajectory
+        if self._peak is None:
+            return None
+        return self._peak if per_trajectory else np.max(self._peak, axis=1)
+
+
+class Running_Cost (Aggregator):
+    '''
+    The running cost sum_t || weight z(t) ||^2 of each trajectory, skipping the first burn_in steps.
+
+    With unit-variance white noise, getAverageCost() estimates the stationary per-step cost
+        E || z(t) ||^2 = || [C1, D12][Phi_x; Phi_u] B1 ||_H2^2 + || D11 ||_F^2
+    which is comparable with SLS.getOptimalObjectiveValue() of SLS_Obj_H2 (D11 = 0 for the generated plants)
+    '''
+    def __init__ (self, signal='z', weight=None, burn_in=0):
+        Aggregator.__init__(self, signal=signal)
+        self._weight = weight
+        self._burn_in = burn_in
+
+    def initialize (self, trajectories=None):
+        Aggregator.initialize(self, trajectories=trajectories)
+        self._cost = np.zeros(self._trajectories)
+        self._cost_steps = 0
+
+    def aggregate (self, value):
+        if self._t <= self._burn_in:
+            return
+        if self._weight is not None:
+            value = self._weight.dot(value)
+        self._cost += np.sum(np.square(value), axis=0)
+        self._cost_steps += 1
+
+    def getCost (self, per_trajectory=False):
+        # the accumulated cost, averaged over the trajectories unless per_trajectory
+        return self._cost.copy() if per_trajectory else np.mean(self._cost)
+
+    def getAverageCost (self, per_trajectory=False):
+        # the cost per time step
+        if self._cost_steps == 0:
+            return None
+        return self.getCost(per_trajectory=per_trajectory) / self._cost_steps
+
+    def getCostQuantiles (self, quantiles=(0.5,), average=True):
+        # the quantiles of the (average) cost across the trajectories, e.g., across seeds
+        cost = self.getAverageCost(per_trajectory=True) if average else self._cost
+        if cost is None:
+            return None
+        return np.quantile(cost, quantiles)
+
+
+class Streaming_Quantiles (Aggregator):
+    '''
+    The quantiles of each component of a signal over the time steps and the trajectories.
+    The sketch keeps resolution equally weighted points per component: the samples are buffered,
+    and every resolution samples are merged into the points by resampling the combined distribution,
+    so the memory does not grow with the horizon and the rank error is about 1/resolution
+    absolute=True estimates the quantiles of the magnitude instead, e.g., of |u|
+    '''
+    def __init__ (self, signal='x', quantiles=(0.5, 0.9, 0.99), absolute=False, resolution=1024):
+        Aggregator.__init__(self, signal=signal)
+        self._quantiles = tuple(quantiles)
+        self._absolute = absolute
+        self._resolution = resolution
+
+    def initialize (self, trajectories=None):
+        Aggregator.initialize(self, trajectories=trajectories)
+        self._points = None # (N,resolution) sorted points, each with weight total/resolution
+        self._total = 0
+        self._buffer = []
+        self._buffered = 0
+
+    def aggregate (self, value):
+        if self._absolute:
+            value = np.absolute(value)
+        # the values may be overwritten by the next step
+        self._buffer.append(np.array(value, dtype=float))
+        self._buffered += value.shape[1]
+        if self._buffered >= self._resolution:
+            self.__merge()
+
+    def __merge (self):
+        samples = np.hstack(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+
+        m = self._resolution
+        if self._points is None:
+            values = samples
+            weights = np.ones(samples.shape[1])
+        else:
+            values = np.hstack([self._points, samples])
+            weights = np.concatenate([np.full(m, self._total / m), np.ones(samples.shape[1])])
+        total = self._total + samples.shape[1]
+
+        # resample the combined weighted distribution of each component at m equally weighted points
+        order = np.argsort(values, axis=1)
+        values = np.take_along_axis(values, order, axis=1)
+        weights = weights[order]
+        centers = np.cumsum(weights, axis=1) - weights / 2
+        targets = (np.arange(m) + 0.5) * (total / m)
+        self._points = np.stack([np.interp(targets, centers[i], values[i]) for i in range(values.shape[0])])
+        self._total = total
+
+    def getQuantiles (self):
+        # a dict that maps each quantile to its (N,) estimate
+        if self._points is None:
+            if self._buffered == 0:
+                return None
+            samples = np.hstack(self._buffer)
+            return {p: np.quantile(samples, p, axis=1) for p in self._quantiles}
+
+        if self._buffered > 0:
+            self.__merge()
+        m = self._resolution
+        quantiles = {}
+        for p in self._quantiles:
+            position = np.clip(p * m - 0.5, 0, m - 1)
+            lower = int(np.floor(position))
+            upper = min(lower + 1, m - 1)
+            fraction = position - lower
+            quantiles[p] = (1 - fraction) * self._points[:,lower] + fraction * self._points[:,upper]
+        return quantiles
@@ -0,0 +1,299 @@
+from .core import ObjBase
+from .convolution import fir_convolve
+import numpy as np
+import scipy.sparse as sp
+'''
+The closed loop of a linear system and a linear controller, compiled into one augmented state-space model.
+
+The system and the controller expose their realizations through
+    SystemModel.getStateSpaceRealization()
+    ControllerModel.getStateSpaceRealization()
+'''
+
+class LTI_ClosedLoop (ObjBase):
+    '''
+    With the system
+        x(t+1) = A  x(t) + B1  w(t) + B2  u(t)
+        z(t)   = C1 x(t) + D11 w(t) + D12 u(t)
+        y(t)   = C2 x(t) + D21 w(t) + D22 u(t)
+    and the controller
+        xi(t+1) = Ak xi(t) + Bk y(t)
+        u(t)    = Ck xi(t) + Dk y(t)
+    the closed loop is
+        s(t+1)                 = A_cl s(t) + B_cl w(t)
+        [ u(t); y(t); z(t) ]   = C_cl s(t) + D_cl w(t)
+    where s = [ x; xi ].
+    The algebraic loop between y(t) and u(t) is solved exactly, i.e.,
+        u(t) = (I - Dk D22)^{-1} (Ck xi(t) + Dk C2 x(t) + Dk D21 w(t))
+    '''
+    def __init__ (self, system=None, controller=None):
+        self._system = system
+        self._controller = controller
+
+        # [ A_cl; C_cl ] and [ B_cl; D_cl ]
+        self._G_s = None
+        self._G_w = None
+
+        self._s = None
+        self._y = None
+        self._z = None
+
+    def compile (self):
+        # build the closed-loop matrices
+        # return False quietly if the system or the controller has no state-space realization
+        system_realization = self._system.getStateSpaceRealization()
+        if system_realization is None:
+            return False
+        controller_realization = self._controller.getStateSpaceRealization()
+        if controller_realization is None:
+            return False
+
+        A, B1, B2, C1, D11, D12, C2, D21, D22 = system_realization
+        Ak, Bk, Ck, Dk = controller_realization
+
+        Nx  = A.shape[0]
+        Nu  = B2.shape[1]
+        Ny  = C2.shape[0]
+        Nxi = Ak.shape[0]
+
+        if (Dk.shape[0] != Nu) or (Dk.shape[1] != Ny):
+            return self.errorMessage('Dimension mismatch: the controller does not map y to u')
+        if (Bk.shape[1] != Ny) or (Ck.shape[1] != Nxi):
+            return self.errorMessage('Dimension mismatch: controller realization')
+
+        # the controller realization is mostly shift registers, hence sparse
+        A, B1, B2, C1, D11, D12, C2, D21, D22, Ak, Bk, Ck, Dk = [
+            None if matrix is None else sp.csr_matrix(matrix)
+            for matrix in (A, B1, B2, C1, D11, D12, C2, D21, D22, Ak, Bk, Ck, Dk)
+        ]
+
+        loop = np.eye(Nu) - (Dk @ D22).toarray()
+        if np.linalg.matrix_rank(loop) < Nu:
+            return self.errorMessage('The algebraic loop between y and u is ill-posed.')
+        M = sp.csr_matrix(np.linalg.inv(loop))
+
+        # u = K_s s + K_w w
+        K_s = M @ sp.hstack([Dk @ C2, Ck])
+        K_w = M @ (Dk @ D21)
+
+        # y = Y_s s + Y_w w
+        Y_s = sp.hstack([C2, sp.csr_matrix((Ny,Nxi))]) + D22 @ K_s
+        Y_w = D21 + D22 @ K_w
+
+        # s(t+1)
+        S_s = sp.vstack([
+            sp.hstack([A, sp.csr_matrix((Nx,Nxi))]) + B2 @ K_s,
+            sp.hstack([sp.csr_matrix((Nxi,Nx)), Ak]) + Bk @ Y_s
+        ])
+        S_w = sp.vstack([
+            B1 + B2 @ K_w,
+            Bk @ Y_w
+        ])
+
+        rows_s = [S_s, K_s, Y_s]
+        rows_w = [S_w, K_w, Y_w]
+        if C1 is not None:
+            rows_s.append(sp.hstack([C1, sp.csr_matrix((C1.shape[0],Nxi))]) + D12 @ K_s)
+            rows_w.append(D11 + D12 @ K_w)
+
+        self._G_s = sp.vstack(rows_s, format='csr')
+        self._G_w = sp.vstack(rows_w, format='csr')
+        self._G_s.eliminate_zeros()
+        self._G_w.eliminate_zeros()
+        self._G_s = self._asDtype(self._G_s)
+        self._G_w = self._asDtype(self._G_w)
+
+        self._Nx  = Nx
+        self._Nu  = Nu
+        self._Ny  = Ny
+        self._Ns  = Nx + Nxi
+
+        return True
+
+    def getClosedLoopMatrices (self):
+        # return A_cl, B_cl, C_cl, D_cl as sparse matrices, where C_cl and D_cl map to [ u; y; z ]
+        Ns = self._Ns
+        return self._G_s[:Ns], self._G_w[:Ns], self._G_s[Ns:], self._G_w[Ns:]
+
+    def initialize (self):
+        # start from the current states of the system and the controller
+        x  = self._system.getState()
+        xi = self._controller.getRealizationState()
+        if xi.shape[1] != x.shape[1]:
+            xi = np.repeat(xi, x.shape[1] // xi.shape[1], axis=1)
+        self._s = np.vstack([x, xi])
+
+    def step (self, w=None):
+        # advance one step and return x(t), y, z(t), u(t)
+        # y follows SystemModel.getMeasurement(), i.e., y = x(t+1) for a state-feedback system
+        if w is None:
+            signals = self._G_s.dot(self._s)
+        else:
+            signals = self._G_s.dot(self._s) + self._G_w.dot(w)
+
+        Ns = self._Ns
+        Nx = self._Nx
+        x = self._s[:Nx]
+        self._s = signals[:Ns]
+        u = signals[Ns:Ns+self._Nu]
+        self._y = signals[Ns+self._Nu:Ns+self._Nu+self._Ny]
+        if signals.shape[0] > Ns+self._Nu+self._Ny:
+            self._z = signals[Ns+self._Nu+self._Ny:]
+        else:
+            self._z = None
+
+        if self._system._state_feedback:
+            y = self._s[:Nx]
+        else:
+            y = self._y
+
+        return x, y, self._z, u
+
+    def commit (self):
+        # write the closed-loop state back to the system and the controller
+        if self._s is None:
+            return
+        self._system._x = self._s[:self._Nx]
+        if self._y is not None:
+            self._system._y = self._y
+        if self._z is not None:
+            self._system._z = self._z
+        self._controller.setRealizationState(self._s[self._Nx:])
+
+class SLS_ClosedLoopResponse (ObjBase):
+    '''
+    The closed loop of an LTI state-feedback system and the SLS state-feedback FIR controller synthesized for it.
+    On the nominal plant, the closed-loop responses are exactly
+        x = Phi_x delta,    u = Phi_u delta
+    where delta[-1] = x0 and delta[t] = B1 w(t), so the whole trajectory is a convolution of the taps
+    with the noise sequence, which is known up front for FixedNoiseVector.
+    '''
+    def __init__ (self, system=None, controller=None, noise=None, tolerance=1e-8):
+        self._system = system
+        self._controller = controller
+        self._noise = noise
+        self._tolerance = tolerance
+
+        self._Phi = None
+
+    def compile (self):
+        # stack the taps as [ Phi_x; Phi_u ]
+        # return False quietly if the closed loop is not of the form above
+        from .system_models import LTI_System
+        from .noise_models import FixedNoiseVector
+        from .sls.controller_models import SLS_StateFeedback_FIR_Controller
+
+        if not (isinstance(self._system, LTI_System) and self._system._state_feedback):
+            return False
+        if self._system.getStateSpaceRealization() is None:
+            # e.g., an ensemble of plants
+            return False
+        if not isinstance(self._controller, SLS_StateFeedback_FIR_Controller):
+            return False
+        if not ((self._noise is None) or isinstance(self._noise, FixedNoiseVector)):
+            return False
+
+        A  = self._system._A
+        B2 = self._system._B2
+        Nx = self._system._Nx
+        Nu = self._system._Nu
+        H  = self._controller._FIR_horizon
+        if (self._controller._Nx != Nx) or (self._controller._Nu != Nu):
+            return False
+
+        Phi_x = self._controller._concatenate_taps(self._controller._Phi_x, 0, H+1, (Nx,Nx))
+        Phi_u = self._controller._concatenate_taps(self._controller._Phi_u, 0, H+1, (Nu,Nx))
+        Phi_x = Phi_x.reshape(Nx, H+1, Nx).transpose(1,0,2)
+        Phi_u = Phi_u.reshape(Nu, H+1, Nx).transpose(1,0,2)
+
+        # the responses are exact only if the taps satisfy the SLS constraints on this system
+        #   Phi_x[1] = I, Phi_x[t+1] = A Phi_x[t] + B2 Phi_u[t], A Phi_x[H] + B2 Phi_u[H] = 0
+        residual = np.max(np.absolute(Phi_x[1] - np.eye(Nx)))
+        for tau in range(1,H+1):
+            next_Phi_x = Phi_x[tau+1] if tau < H else 0
+            residual = max(residual, np.max(np.absolute(next_Phi_x - A @ Phi_x[tau] - B2 @ Phi_u[tau])))
+        if (residual > self._tolerance) or np.any(Phi_x[0] != 0) or np.any(Phi_u[0] != 0):
+            return False
+
+        self._Phi = self._asDtype(np.concatenate([Phi_x, Phi_u], axis=1))
+        self._Nx = Nx
+        self._Nu = Nu
+
+        return True
+
+    def _noiseSequence (self, horizon, trajectories=1):
+        # return the (horizon, Nw, trajectories) noise sequence the simulation would draw as (history, signal)
+        # the history is None without noise, both are None if the stored noise does not fit
+        Nw = self._system._Nw
+        w = np.zeros([horizon, Nw, trajectories], dtype=self._Phi.dtype)
+        if self._noise is None:
+            return None, w
+
+        t0 = self._noise._t
+        available = max(min(horizon, self._noise._horizon - t0), 0)
+        stored = self._noise.getBlock()
+        if (available > 0) and (stored.shape[2] not in (1, trajectories)):
+            return None, None
+        w[:available] = stored[t0:t0+available]
+        return w, w
+
+    def respond (self, horizon, trajectories=1):
+        # return the (horizon, dimension, trajectories) histories x, y, z, u, w, or None if unavailable
+        w_history, w = self._noiseSequence(horizon=horizon, trajectories=trajectories)
+        if w is None:
+            return None
+
+        x0 = self._system.getState()
+        if x0.shape[1] not in (1, trajectories):
+            return None
+
+        # delta[0] = x0, delta[t+1] = B1 w(t), and delta[horizon+1] is not used since Phi[0] = 0
+        delta = np.zeros([horizon+2, self._Nx, trajectories], dtype=w.dtype)
+        delta[0] = x0
+        delta[1:horizon+1] = self._apply(self._system._B1, w)
+
+        # [ x(t); u(t) ] = sum_tau [ Phi_x[tau]; Phi_u[tau] ] delta[t+1-tau]
+        response = fir_convolve(self._Phi, delta)
+
+        self._delta = delta
+        self._horizon = horizon
+        self._x_end = response[horizon+1, :self._Nx]
+
+        x_history = response[1:horizon+1, :self._Nx]
+        y_history = response[2:horizon+2, :self._Nx]
+        u_history = response[1:horizon+1, self._Nx:]
+        if self._system._ignore_output:
+            z_history = None
+        else:
+            z_history = (
+                self._apply(self._system._C1,  x_history) +
+                self._apply(self._system._D11, w) +
+                self._apply(self._system._D12, u_history)
+            )
+        self._z_end = None if z_history is None else z_history[-1]
+
+        if self._noise is not None:
+            self._noise._t = max(self._noise._t, min(self._noise._t + horizon, self._noise._horizon))
+
+        return x_history, y_history, z_history, u_history, w_history
+
+    @staticmethod
+    def _apply (matrix, sequence):
+        # matrix sequence[t] for every t of a (horizon, dimension, trajectories) sequence, the matrix can be scipy.sparse
+        horizon, dimension, trajectories = sequence.shape
+        flat = sequence.transpose(1,0,2).reshape(dimension, horizon*trajectories)
+        return np.asarray(matrix @ flat).reshape(matrix.shape[0], horizon, trajectories).transpose(1,0,2)
+
+    def commit (self):
+        # leave the system, the controller, and the noise as a step-by-step simulation would
+        self._system._x = self._x_end
+        if self._z_end is not None:
+            self._system._z = self._z_end
+
+        # the controller keeps its last FIR_horizon-1 inputs, which are delta[horizon-1], delta[horizon-2], ...
+        H = self._controller._FIR_horizon
+        xi = np.zeros([H-1, self._Nx, self._delta.shape[2]], dtype=self._delta.dtype)
+        for i in range(min(H-1, self._horizon)):
+            xi[i] = self._delta[self._horizon-1-i]
+        self._controller.setRealizationState(xi.reshape((H-1)*self._Nx, self._delta.shape[2]))
+
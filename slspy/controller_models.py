@@ -1,5 +1,6 @@
 from .core import ControllerModel
 import numpy as np
+import scipy.sparse as sp
 '''
 To create a new controller model, inherit the following base function and customize the specified methods.
 
@@ -28,4 +29,57 @@ class OpenLoopController (ControllerModel):
         return self._u.copy()
 
     def getControl(self, y):
-        return self._u.copy()
\ No newline at end of file
+        return self._u.copy()
+
+
+class Lockstep_Controllers (ControllerModel):
+    '''
+    Several controllers run side by side on one batched plant, c.f. Simulator.runControllers().
+    The signals are (N, len(controllers)*K) matrices whose m-th block of K columns belongs to the m-th controller.
+    '''
+    def __init__ (self, controllers=None, trajectories=1):
+        self._controllers = controllers if controllers is not None else []
+        self._K = trajectories
+
+    def setDtype (self, dtype=None):
+        ControllerModel.setDtype(self, dtype)
+        for controller in self._controllers:
+            controller.setDtype(dtype)
+
+    def _dtypes (self):
+        return ControllerModel._dtypes(self) + [entry for controller in self._controllers for entry in controller._dtypes()]
+
+    def initialize (self):
+        for controller in self._controllers:
+            controller.initialize()
+
+    def close (self):
+        for controller in self._controllers:
+            controller.close()
+
+    def getColumns (self, index):
+        # the columns of the index-th controller
+        return slice(index*self._K, (index+1)*self._K)
+
+    def __stack (self, function, y):
+        controls = [function(controller, y[:,self.getColumns(m)]) for m, controller in enumerate(self._controllers)]
+        # a controller may return one (N,1) control for all its trajectories
+        return np.hstack([np.broadcast_to(u, (u.shape[0], self._K)) for u in controls])
+
+    def controlConvergence (self, y):
+        return self.__stack(lambda controller, y_m: controller.controlConvergence(y=y_m), y)
+
+    def getControl (self, y):
+        return self.__stack(lambda controller, y_m: controller.getControl(y=y_m), y)
+
+    def getFeedthrough (self):
+        # one Dk for all the columns only if the controllers agree, otherwise the loop is iterated
+        feedthroughs = [controller.getFeedthrough() for controller in self._controllers]
+        if len(feedthroughs) == 0 or any(Dk is None for Dk in feedthroughs):
+            return None
+        Dk = feedthroughs[0]
+        dense = np.asarray(Dk.todense()) if sp.issparse(Dk) else Dk
+        for other in feedthroughs[1:]:
+            if not np.array_equal(dense, np.asarray(other.todense()) if sp.issparse(other) else other):
+                return None
+        return Dk
@@ -0,0 +1,169 @@
+from .core import error_message
+import numpy as np
+import scipy.fft
+'''
+Numerical convolutions of FIR filters with signals
+
+    fir_convolve: the response to a whole input sequence known up front (offline),
+                  computed directly or by FFT / overlap-save, whichever is cheaper
+    FIR_Buffer:   the recent inputs of a filter driven one step at a time (online)
+    stack_taps:   the taps side by side, which multiply the window of a FIR_Buffer
+'''
+
+def fir_convolve (taps=None, sequence=None, method='auto'):
+    '''
+    Causal convolution truncated to the length of the sequence
+        out[t] = sum_tau taps[tau] sequence[t-tau],  t = 0, 1, ..., len(sequence)-1
+    Inputs
+    taps     : (FIR_len, Nout, Nin) array, or a list of (Nout, Nin) matrices
+    sequence : (length, Nin) or (length, Nin, trajectories) array
+    method   : 'auto', 'direct', 'fft', or 'overlap_save'
+    Outputs
+    out      : (length, Nout) or (length, Nout, trajectories) array
+    '''
+    taps = np.asarray(taps)
+    sequence = np.asarray(sequence)
+    single = (sequence.ndim == 2)
+    if single:
+        sequence = sequence[:,:,np.newaxis]
+
+    if method == 'auto':
+        method = choose_convolution_method(taps.shape, sequence.shape)
+
+    if method == 'direct':
+        out = _direct_convolve(taps, sequence)
+    elif method == 'fft':
+        out = _fft_convolve(taps, sequence)
+    elif method == 'overlap_save':
+        out = _overlap_save_convolve(taps, sequence)
+    else:
+        error_message('Unknown convolution method: '+str(method))
+        return None
+
+    out = out.astype(np.result_type(taps, sequence), copy=False)
+    return out[:,:,0] if single else out
+
+def choose_convolution_method (taps_shape, sequence_shape):
+    '''
+    Pick the cheapest method by counting the floating-point operations
+    taps_shape     : (FIR_len, Nout, Nin)
+    sequence_shape : (length, Nin, trajectories)
+    '''
+    FIR_len, Nout, Nin = taps_shape
+    length = sequence_shape[0]
+    columns = sequence_shape[2] if len(sequence_shape) > 2 else 1
+
+    # every tap multiplies every (shifted) input
+    costs = {'direct': 2.0 * min(FIR_len, length) * length * Nout * Nin * columns}
+
+    def transform_cost (n, blocks):
+        # real transforms of the taps once, of the inputs and outputs per block,
+        # and the complex products per frequency
+        transforms = 2.5 * n * np.log2(max(n,2))
+        frequencies = n // 2 + 1
+        return (transforms * (Nout * Nin + blocks * (Nin + Nout) * columns) +
+                8.0 * blocks * frequencies * Nout * Nin * columns)
+
+    n = scipy.fft.next_fast_len(length + FIR_len - 1)
+    costs['fft'] = transform_cost(n, 1)
+
+    n, step = _overlap_save_block(FIR_len)
+    costs['overlap_save'] = transform_cost(n, -(-length // step))
+
+    return min(costs, key=costs.get)
+
+def stack_taps (taps=None, lb=0, ub=0, shape=(0,0)):
+    # return [ taps[lb], taps[lb+1], ..., taps[ub-1] ] as a matrix, the missing taps are zeros
+    stacked = []
+    for tau in range(lb,ub):
+        if (tau < len(taps)) and (taps[tau] is not None):
+            stacked.append(taps[tau])
+        else:
+            stacked.append(np.zeros(shape))
+    if len(stacked) == 0:
+        return np.zeros([shape[0],0])
+    return np.hstack(stacked)
+
+def _direct_convolve (taps, sequence):
+    # block-Toeplitz product, one matrix product per tap on the (dimension, time x trajectories) layout
+    length, Nin, columns = sequence.shape
+    Nout = taps.shape[1]
+    flat = sequence.transpose(1,0,2).reshape(Nin, length*columns)
+    out = np.zeros([Nout, length*columns], dtype=np.result_type(taps, sequence))
+    for tau in range(min(taps.shape[0], length)):
+        out[:, tau*columns:] += np.dot(taps[tau], flat[:, :(length-tau)*columns])
+    return out.reshape(Nout, length, columns).transpose(1,0,2)
+
+def _fft_convolve (taps, sequence):
+    # one transform of the whole sequence, one matrix product per frequency
+    length = sequence.shape[0]
+    n = scipy.fft.next_fast_len(length + taps.shape[0] - 1)
+    spectrum = np.matmul(scipy.fft.rfft(taps, n=n, axis=0), scipy.fft.rfft(sequence, n=n, axis=0))
+    return scipy.fft.irfft(spectrum, n=n, axis=0)[:length]
+
+def _overlap_save_block (FIR_len):
+    # the transform size and the number of new outputs per block
+    n = scipy.fft.next_fast_len(max(4 * FIR_len, 64))
+    return n, n - FIR_len + 1
+
+def _overlap_save_convolve (taps, sequence):
+    # transform overlapping blocks of the sequence, each block keeps the outputs free of wrap-around
+    FIR_len = taps.shape[0]
+    length, Nin, columns = sequence.shape
+    n, step = _overlap_save_block(FIR_len)
+    blocks = -(-length // step)
+
+    # FIR_len-1 zeros of history in front, zeros to complete the last block behind
+    padded = np.zeros([FIR_len - 1 + blocks * step, Nin, columns], dtype=sequence.dtype)
+    padded[FIR_len-1:FIR_len-1+length] = sequence
+    # block b reads padded[b*step : b*step+n], the last one ends exactly at the end of padded
+    indices = np.arange(blocks)[:,np.newaxis] * step + np.arange(n)[np.newaxis,:]
+    segments = padded[indices]
+
+    spectrum = np.matmul(scipy.fft.rfft(taps, n=n, axis=0), scipy.fft.rfft(segments, n=n, axis=1))
+    out = scipy.fft.irfft(spectrum, n=n, axis=1)[:, FIR_len-1:FIR_len-1+step]
+    return out.reshape(blocks * step, taps.shape[1], columns)[:length]
+
+class FIR_Buffer:
+    '''
+    The most recent signals of a FIR filter, newest first, in a circular buffer
+    '''
+    def __init__ (self, length=0, size=0, dtype=None):
+        self._length = length # number of the stored signals
+        self._size = size     # dimension of a signal
+        self._dtype = dtype
+
+        # each signal is stored twice, at head and head + length,
+        # so that buffer[head:head+length] is always the contiguous window, newest first
+        self._buffer = None
+        self._head = 0
+
+    def clear (self):
+        self._buffer = None
+        self._head = 0
+
+    def push (self, element):
+        if self._length == 0:
+            return
+        columns = element.shape[1]
+        if self._buffer is None:
+            self._buffer = np.zeros([2*self._length, self._size, columns], dtype=self._dtype or element.dtype)
+        elif self._buffer.shape[2] != columns:
+            # a single trajectory is broadcast to all trajectories
+            self._buffer = np.repeat(self._buffer, columns // self._buffer.shape[2], axis=2)
+
+        self._head = (self._head - 1) % self._length
+        self._buffer[self._head] = element
+        self._buffer[self._head + self._length] = element
+
+    def window (self):
+        # [ v[t]; v[t-1]; ... v[t-length+1] ] as a (length * size, columns) matrix
+        if self._buffer is None:
+            return np.zeros([self._length*self._size, 1], dtype=self._dtype)
+        window = self._buffer[self._head:self._head+self._length]
+        return window.reshape(self._length*self._size, -1)
+
+    def setWindow (self, stacked):
+        window = np.asarray(stacked, dtype=self._dtype).reshape(self._length, self._size, -1)
+        self._buffer = np.concatenate([window, window])
+        self._head = 0
@@ -1,5 +1,7 @@
 import inspect
 import numpy as np
+import scipy.linalg
+from .random_streams import as_generator
 '''
 The core abstract classes that form the SLSpy framework:
 
@@ -12,9 +14,29 @@ class ObjBase:
     '''
     The object base that defines debugging tools
     '''
+    # the floating-point type of the internal arrays, None keeps the types of the given arrays (float64 by default)
+    _dtype = None
+
     def initialize (self, **kwargs):
         pass
 
+    def setDtype (self, dtype=None):
+        # the setting takes effect at the next initialize()
+        self._dtype = dtype
+
+    def getDtype (self):
+        return self._dtype
+
+    def _dtypes (self):
+        # the objects whose dtypes setDtype() changes, with their current dtypes, c.f. Simulator._lendDtype()
+        return [(self, self._dtype)]
+
+    def _asDtype (self, array):
+        # cast a numpy array or a scipy.sparse matrix to the dtype of this object
+        if (self._dtype is None) or (array is None):
+            return array
+        return array.astype(self._dtype, copy=False)
+
     def sanityCheck (self):
         # check the system parameters are coherent
         return True
@@ -67,20 +89,45 @@ class SystemModel (ObjBase):
         # i.e., it does change the system's internal state
         pass
 
-    def getState(self):
-        return self._x.copy()
+    def getFeedthrough (self):
+        # A system affine in u can return the matrix D22 such that
+        #   y(t) = (terms independent of u(t)) + D22 u(t)
+        # so that the simulator can solve the convergence phase directly
+        # None means no such matrix is available
+        return None
+
+    def getRequiredTrajectories (self):
+        # A system that simulates a fixed number of trajectories side by side, e.g., an ensemble of plants,
+        # returns that number, which the simulator must use
+        # None means any number of trajectories
+        return None
+
+    def getStateSpaceRealization (self):
+        # A linear system can return its matrices
+        #   (A, B1, B2, C1, D11, D12, C2, D21, D22)
+        # of the realization
+        #   x(t+1) = A  x(t) + B1  w(t) + B2  u(t)
+        #   z(t)   = C1 x(t) + D11 w(t) + D12 u(t)
+        #   y(t)   = C2 x(t) + D21 w(t) + D22 u(t)
+        # so that the simulator can compile the closed loop
+        # None means no such realization is available
+        return None
+
+    # copy=False returns the internal arrays, which the caller must not modify
+    def getState(self, copy=True):
+        return self._x.copy() if copy else self._x
 
-    def getMeasurement(self):
+    def getMeasurement(self, copy=True):
         if self._state_feedback:
-            return self._x.copy()
+            return self._x.copy() if copy else self._x
         else:
-            return self._y.copy()
+            return self._y.copy() if copy else self._y
     
-    def getOutput(self):
+    def getOutput(self, copy=True):
         if self._ignore_output:
             return None
         else:
-            return self._z.copy()
+            return self._z.copy() if copy else self._z
 
     def ignoreOutput (self, ignore_output=False):
         # Does this model ignore output?
@@ -111,11 +158,46 @@ class ControllerModel (ObjBase):
         # this function commits the control, i.e., the measurement y will really change the controller state
         return None
 
+    def getFeedthrough (self):
+        # A controller affine in y can return the matrix Dk such that
+        #   u(t) = (terms independent of y(t)) + Dk y(t)
+        # so that the simulator can solve the convergence phase directly
+        # None means no such matrix is available
+        return None
+
+    def getStateSpaceRealization (self):
+        # A linear controller can return its matrices (Ak, Bk, Ck, Dk) of the realization
+        #   xi(t+1) = Ak xi(t) + Bk y(t)
+        #   u(t)    = Ck xi(t) + Dk y(t)
+        # where xi is the vectorized controller state, c.f. getRealizationState()
+        # the matrices can be numpy arrays or scipy.sparse matrices
+        # None means no such realization is available
+        return None
+
+    def close (self):
+        # release the resources held for the simulation, e.g., worker threads
+        # called by the simulator at the end of each simulation, the controller reacquires them when stepped again
+        pass
+
+    def getRealizationState (self):
+        # return the current controller state xi of the realization
+        return None
+
+    def setRealizationState (self, xi):
+        # overwrite the controller state by xi of the realization
+        pass
+
 class NoiseModel (ObjBase):
     '''
     The base class for noise model.
     NoiseModel is responsible for the right format of noise (dimension, etc.)
     '''
+    # the random generator(s), None draws from the global numpy.random state, c.f. setRandomGenerator()
+    _rng = None
+    # True if generateBlock(horizon) returns exactly the next horizon draws of getNoise(),
+    # which lets the simulator draw the noise in blocks
+    _block_consistent = False
+
     def __init__ (self, Nw=0):
         self._Nw = Nw  # dimension of the noise (disturbance)
 
@@ -127,6 +209,42 @@ class NoiseModel (ObjBase):
         # the noise can depend on some parameters such as state or control
         return 0
 
+    def generateBlock (self, horizon=1, trajectories=None):
+        # the noise of the next horizon steps in one array, (horizon,Nw) or (horizon,Nw,trajectories)
+        # the default calls getNoise() per step, override it to generate the block at once
+        K = 1 if trajectories is None else trajectories
+        kwargs = {} if trajectories is None else {'trajectories': trajectories}
+        block = np.empty([horizon, self._Nw, K], dtype=self._dtype if self._dtype is not None else float)
+        for t in range(horizon):
+            block[t] = np.broadcast_to(self.getNoise(**kwargs), (self._Nw, K))
+        return block[:,:,0] if trajectories is None else block
+
+    def setRandomGenerator (self, rng=None):
+        # rng is a seed (int, SeedSequence, or Generator, c.f. random_streams), or a list of seeds, one per trajectory
+        # with one stream per trajectory, each trajectory is reproducible regardless of the batching
+        if isinstance(rng, (list, tuple)):
+            self._rng = [as_generator(seed) for seed in rng]
+        else:
+            self._rng = as_generator(rng)
+
+    def getRandomGenerator (self):
+        return self._rng
+
+    def _draw (self, sample, trajectories=1, horizon=None):
+        # sample(generator, size) draws from numpy.random or a Generator, e.g.,
+        #   lambda generator, size: generator.normal(0, 1, size)
+        # returns a (Nw,trajectories) matrix, or a (horizon,Nw,trajectories) block
+        # a block consumes the streams in the same order as horizon single draws
+        size = (self._Nw,) if horizon is None else (horizon, self._Nw)
+        if self._rng is None:
+            return sample(np.random, size + (trajectories,))
+        if isinstance(self._rng, list):
+            if len(self._rng) != trajectories:
+                self.errorMessage('One random stream per trajectory is required.')
+                return None
+            return np.stack([sample(generator, size) for generator in self._rng], axis=-1)
+        return sample(self._rng, size + (trajectories,))
+
 class SynthesisAlgorithm (ObjBase):
     '''
     The base class for synthesis algorithm, which takes a system model and generates a controller model correspondingly.
@@ -150,19 +268,35 @@ class Simulator (ObjBase):
     '''
     The simulator
     '''
+    # the number of steps of the noise drawn at once by run(), c.f. _noiseSteps()
+    _noise_block_length = 1024
+
     def __init__ (self, 
         system=None,
         controller=None,
         noise=None,
         horizon=-1,
-        convergence_threshold=1e-10
+        convergence_threshold=1e-10,
+        convergence_method='auto',
+        convergence_max_iterations=None,
+        trajectories=None,
+        closed_loop_compilation='auto',
+        dtype=None,
+        response_convolution=False
     ):
         self.setSystem (system)
         self.setController (controller)
         self.setNoise (noise)
         self.setHorizon (horizon)
         self.setConvergenceThreshold (convergence_threshold)
-        pass
+        self.setConvergenceMethod (convergence_method, max_iterations=convergence_max_iterations)
+        self.setTrajectories (trajectories)
+        self.setClosedLoopCompilation (closed_loop_compilation)
+        self.setDtype (dtype)
+        self.setResponseConvolution (response_convolution)
+
+        self._convergence_iterations = []
+        self._convergence_residuals  = []
 
     def setSystem (self, system=None):
         if isinstance(system, SystemModel):
@@ -185,69 +319,517 @@ class Simulator (ObjBase):
     def setConvergenceThreshold (self, convergence_threshold=1e-10):
         self._convergence_threshold = convergence_threshold
 
-    def run (self,initialize=True):
+    def setConvergenceMethod (self, convergence_method='auto', max_iterations=None, anderson_depth=5):
+        # how the convergence phase of an output-feedback simulation is solved
+        # 'auto':        solve y(t) = y_free + D22 (u_free + Dk y(t)) directly if both the system
+        #                and the controller provide their feedthrough terms, otherwise iterate
+        # 'fixed_point': iterate y <- measurementConverge(controlConvergence(y))
+        #                until the change of y is below the convergence threshold
+        # 'anderson':    Anderson-accelerated fixed-point iteration using the last anderson_depth residuals
+        # max_iterations bounds the iterations per step (None: unbounded)
+        self._convergence_method = convergence_method
+        self._convergence_max_iterations = max_iterations
+        self._anderson_depth = anderson_depth
+
+    def getConvergenceReport (self):
+        # return the number of iterations and the final squared residual of each convergence phase
+        # in the last simulation, both are empty if there is no convergence phase
+        return np.array(self._convergence_iterations, dtype=int), np.array(self._convergence_residuals)
+
+    def _factorizeLoop (self):
+        # return the LU factorization of (I - D22 Dk), or None if the loop has to be iterated
+        if self._convergence_method != 'auto':
+            return None
+
+        D22 = self._system.getFeedthrough()
+        if D22 is None:
+            return None
+        Dk = self._controller.getFeedthrough()
+        if Dk is None:
+            return None
+
+        # D22 can be scipy.sparse
+        loop = np.eye(D22.shape[0]) - np.asarray(D22 @ Dk)
+        if np.linalg.matrix_rank(loop) < loop.shape[0]:
+            self.warningMessage('The algebraic loop between y and u is ill-posed, iterate instead.')
+            return None
+        return scipy.linalg.lu_factor(self._asDtype(loop))
+
+    def setDtype (self, dtype=None):
+        # None:       keep the dtypes of the system, the controller, and the noise
+        # np.float32: run the whole simulation in single precision, which halves the memory traffic
+        # the dtype is lent to the models for each run and their own dtypes are restored afterwards, c.f. _lendDtype()
+        self._dtype = dtype
+
+    def _lendDtype (self):
+        # set the dtype of the models for a run, return their own dtypes for _restoreDtype()
+        saved = []
+        if self._dtype is None:
+            return saved
+        for model in (self._system, self._controller, self._noise):
+            if model is not None:
+                saved += model._dtypes()
+                model.setDtype(self._dtype)
+        return saved
+
+    @staticmethod
+    def _restoreDtype (saved):
+        for model, dtype in saved:
+            model._dtype = dtype
+
+    def setTrajectories (self, trajectories=None):
+        # None: simulate a single trajectory with (N,1) column vectors
+        # K:    batched mode, simulate K trajectories side by side as (N,K) matrices
+        if trajectories is None:
+            self._trajectories = None
+        elif isinstance(trajectories, int) and trajectories > 0:
+            self._trajectories = trajectories
+
+    def setClosedLoopCompilation (self, closed_loop_compilation='auto'):
+        # 'auto': compile the closed loop if both the system and the controller provide state-space realizations
+        # True:   always compile the closed loop, report an error if not possible
+        # False:  simulate the system and the controller step by step
+        self._closed_loop_compilation = closed_loop_compilation
+
+    def setResponseConvolution (self, response_convolution=False, tolerance=1e-8):
+        # True:  if an SLS state-feedback controller runs on its nominal LTI plant with a FixedNoiseVector (or no noise),
+        #        compute run() as one convolution of the Phi taps with the noise sequence,
+        #        c.f. SLS_ClosedLoopResponse. Otherwise, simulate as usual.
+        #        The taps must satisfy the SLS constraints of the system up to tolerance.
+        # False: never use the convolution
+        # iterate() and run(initialize=False) always simulate step by step
+        self._response_convolution = response_convolution
+        self._response_tolerance = tolerance
+
+    def _closedLoopResponse (self):
+        # return the closed-loop response model, or None if not applicable
+        if not self._response_convolution:
+            return None
+
+        from .closed_loop_models import SLS_ClosedLoopResponse
+        response = SLS_ClosedLoopResponse(
+            system=self._system, controller=self._controller, noise=self._noise,
+            tolerance=self._response_tolerance
+        )
+        response.setDtype(self._dtype if self._dtype is not None else self._system.getDtype())
+        if response.compile():
+            return response
+        return None
+
+    def _compileClosedLoop (self):
+        # return the compiled closed loop, or None if the simulation is done step by step
+        if self._closed_loop_compilation is False:
+            return None
+
+        from .closed_loop_models import LTI_ClosedLoop
+        closed_loop = LTI_ClosedLoop(system=self._system, controller=self._controller)
+        closed_loop.setDtype(self._system.getDtype())
+        if closed_loop.compile():
+            return closed_loop
+
+        if self._closed_loop_compilation is True:
+            self.warningMessage('Fail to compile the closed loop, simulate step by step instead.')
+        return None
+
+    def _computeControl (self, y, w, need_convergence_phase, loop_factorization=None):
+        if not need_convergence_phase:
+            return self._controller.getControl(y=y)
+
+        if loop_factorization is not None:
+            # both sides are affine, the measurement with zero feedback is
+            #   y_free + D22 u_free, where u_free is the control with y(t) = 0
+            u_free = self._controller.controlConvergence(y=np.zeros_like(y))
+            y_free = self._system.measurementConverge(u=u_free,w=w)
+            y_convergence = scipy.linalg.lu_solve(loop_factorization, y_free)
+            iterations, residual = 1, 0.0
+        elif self._convergence_method == 'anderson':
+            y_convergence, iterations, residual = self._andersonConverge(y=y, w=w)
+        else:
+            y_convergence, iterations, residual = self._fixedPointConverge(y=y, w=w)
+
+        self._convergence_iterations.append(iterations)
+        self._convergence_residuals.append(residual)
+
+        return self._controller.getControl(y=y_convergence)
+
+    def _convergenceMap (self, y, w):
+        # y -> the measurement under the control generated from y
+        u_convergence = self._controller.controlConvergence(y=y)
+        return self._system.measurementConverge(u=u_convergence,w=w)
+
+    def _keepIterating (self, iterations, residual):
+        if residual <= self._convergence_threshold:
+            return False
+        if self._convergence_max_iterations is None:
+            return True
+        return iterations < self._convergence_max_iterations
+
+    def _fixedPointConverge (self, y, w):
+        y_convergence_prev = y
+        y_convergence = self._convergenceMap(y=y_convergence_prev, w=w)
+        iterations = 1
+        residual = np.sum(np.square(y_convergence_prev - y_convergence))
+
+        while self._keepIterating(iterations, residual):
+            y_convergence_prev = y_convergence
+            y_convergence = self._convergenceMap(y=y_convergence_prev, w=w)
+            iterations += 1
+            residual = np.sum(np.square(y_convergence_prev - y_convergence))
+
+        return y_convergence, iterations, residual
+
+    def _andersonConverge (self, y, w):
+        # Anderson acceleration of y <- g(y) with residual f(y) = g(y) - y:
+        #   y_next = g(y) - sum_i gamma_i (g_i - g_{i-1})
+        # where gamma minimizes || f(y) - sum_i gamma_i (f_i - f_{i-1}) ||
+        y_k = y
+        g_k = self._convergenceMap(y=y_k, w=w)
+        f_k = g_k - y_k
+        iterations = 1
+        residual = np.sum(np.square(f_k))
+
+        delta_g = []
+        delta_f = []
+        while self._keepIterating(iterations, residual):
+            if len(delta_f) > 0:
+                F = np.stack([delta.ravel() for delta in delta_f], axis=1)
+                gamma = np.linalg.lstsq(F, f_k.ravel(), rcond=None)[0]
+                y_next = g_k - sum(gamma[i] * delta_g[i] for i in range(len(delta_g)))
+            else:
+                y_next = g_k
+
+            g_next = self._convergenceMap(y=y_next, w=w)
+            f_next = g_next - y_next
+
+            delta_g.append(g_next - g_k)
+            delta_f.append(f_next - f_k)
+            if len(delta_f) > self._anderson_depth:
+                delta_g.pop(0)
+                delta_f.pop(0)
+
+            y_k, g_k, f_k = y_next, g_next, f_next
+            iterations += 1
+            residual = np.sum(np.square(f_k))
+
+        return g_k, iterations, residual
+
+    def run (self,initialize=True,preallocate=False,recorder=None,aggregators=None):
         # run the system and return 
         #   system state (x)
         #   system measurement (y)
         #   system output (z)
         #   control history (u)
         #   noise history (w)
+        # by default, each history is a list of (N,1) column vectors
+        # preallocate=True writes the histories into arrays of shape (horizon, dimension) instead
+        # in batched mode, each history is an array of shape (horizon, dimension, trajectories)
+        # recorder (c.f. Trajectory_Recorder) writes the histories to the disk instead and the run returns its reader,
+        # initialize=False continues the record
+        # aggregators (c.f. Aggregator) update their statistics at each step instead and the run returns them,
+        # or (reader, aggregators) together with a recorder, initialize=False continues the statistics
         if self._horizon < 0:
             return None, None, None, None
 
-        if not self._system.sanityCheck ():
+        if not self._checkModels ():
             return None, None, None, None
 
+        if (recorder is not None) or (aggregators is not None):
+            return self._stream(recorder=recorder, aggregators=aggregators, initialize=initialize)
+
         if initialize:
-            # initialize
-            self._system.initialize()
-            self._controller.initialize()
-            if self._noise is not None:
-                self._noise.initialize()
+            histories = self._respond()
+            if histories is not None:
+                if (self._trajectories is None) and (not preallocate):
+                    # lists of (N,1) column vectors
+                    return tuple(
+                        [None] * self._horizon if history is None else [history[t].reshape(-1,1) for t in range(self._horizon)]
+                        for history in histories
+                    )
+                return histories
+
+        if (self._trajectories is None) and (not preallocate):
+            x_history = []
+            y_history = []
+            z_history = []
+            u_history = []
+            w_history = []
+
+            for x, y, z, u, w in self._steps(initialize=initialize, copy=True):
+                x_history.append(x)
+                y_history.append(y)
+                z_history.append(z)
+                u_history.append(u)
+                w_history.append(w)
+
+            return x_history, y_history, z_history, u_history, w_history
+
+        histories = (None, None, None, None, None)
+        for t, signals in enumerate(self._steps(initialize=initialize, copy=False)):
+            if t == 0:
+                histories = tuple(self._allocateHistory(value) for value in signals)
+            for history, value in zip(histories, signals):
+                if history is not None:
+                    self._recordHistory(history, t, value)
+
+        return histories
+
+    def _checkModels (self):
+        if not self._system.sanityCheck ():
+            return False
+        required = self._system.getRequiredTrajectories()
+        if (required is not None) and (self._trajectories != required):
+            return self.errorMessage('The system simulates %d trajectories, set the trajectories of the simulator to it.' % required)
+        return True
+
+    def _stream (self, recorder=None, aggregators=None, initialize=True):
+        # pass each step to the recorder and the aggregators without keeping the history
+        if aggregators is None:
+            aggregators = []
+        if initialize:
+            if (recorder is not None) and (not recorder.initialize(trajectories=self._trajectories)):
+                return None
+            for aggregator in aggregators:
+                aggregator.initialize(trajectories=self._trajectories)
+
+        for signals in self._steps(initialize=initialize, copy=False):
+            if recorder is not None:
+                recorder.record(*signals)
+            for aggregator in aggregators:
+                aggregator.update(*signals)
+
+        if recorder is None:
+            return aggregators
+        reader = recorder.getReader()
+        return reader if len(aggregators) == 0 else (reader, aggregators)
+
+    def runControllers (self,controllers=None,preallocate=False,aggregators=None):
+        # run the controllers in lock step, each against its own copy of the system, on exactly the same noise draw
+        # the copies are advanced together as one batch of len(controllers) x trajectories trajectories,
+        # so comparing M controllers costs about one batched run instead of M runs
+        # returns a list with, for each controller, the histories as run(preallocate=preallocate) would return them
+        # aggregators is one list of aggregators (c.f. Aggregator) per controller, and the lists are returned instead
+        if self._horizon < 0 or not controllers:
+            return None
+
+        if not self._system.sanityCheck ():
+            return None
+
+        if (aggregators is not None) and (len(aggregators) != len(controllers)):
+            self.errorMessage('One list of aggregators per controller is required.')
+            return None
+
+        from .controller_models import Lockstep_Controllers
+        from .noise_models import Replicated_Noise
+        K = 1 if self._trajectories is None else self._trajectories
+        lockstep = Lockstep_Controllers(controllers=controllers, trajectories=K)
+        noise = None
+        if self._noise is not None:
+            noise = Replicated_Noise(noise=self._noise, copies=len(controllers), trajectories=self._trajectories)
+
+        simulator = Simulator(
+            system=self._system,
+            controller=lockstep,
+            noise=noise,
+            horizon=self._horizon,
+            convergence_threshold=self._convergence_threshold,
+            convergence_method=self._convergence_method,
+            convergence_max_iterations=self._convergence_max_iterations,
+            trajectories=len(controllers)*K,
+            closed_loop_compilation=False,
+            dtype=self._dtype
+        )
+        simulator._anderson_depth = self._anderson_depth
+        simulator._noise_block_length = self._noise_block_length
+        if not simulator._checkModels ():
+            return None
+
+        if aggregators is not None:
+            for controller_aggregators in aggregators:
+                for aggregator in controller_aggregators:
+                    aggregator.initialize(trajectories=self._trajectories)
+            for signals in simulator._steps(copy=False):
+                for m, controller_aggregators in enumerate(aggregators):
+                    columns = lockstep.getColumns(m)
+                    signals_m = tuple(None if value is None else value[:,columns] for value in signals)
+                    for aggregator in controller_aggregators:
+                        aggregator.update(*signals_m)
+            results = aggregators
+        else:
+            histories = simulator.run(preallocate=True)
+            results = []
+            for m in range(len(controllers)):
+                columns = lockstep.getColumns(m)
+                results.append(tuple(self.__splitHistory(history, columns, preallocate) for history in histories))
+
+        self._convergence_iterations = simulator._convergence_iterations
+        self._convergence_residuals  = simulator._convergence_residuals
+        return results
+
+    def __splitHistory (self, history, columns, preallocate):
+        # the part of a lock-step history that belongs to one controller
+        if history is None:
+            return None if preallocate or self._trajectories is not None else [None] * self._horizon
+        history = history[:,:,columns]
+        if self._trajectories is not None:
+            return history
+        if preallocate:
+            return history[:,:,0]
+        # lists of (N,1) column vectors
+        return [history[t] for t in range(self._horizon)]
+
+    def _respond (self):
+        # return the histories computed by the closed-loop response convolution, or None if not applicable
+        response = self._closedLoopResponse()
+        if response is None:
+            return None
+
+        self._convergence_iterations = []
+        self._convergence_residuals  = []
+        saved = self._lendDtype()
+        try:
+            self._initializeModels()
+            if self._trajectories is None:
+                histories = response.respond(horizon=self._horizon)
+            else:
+                histories = response.respond(horizon=self._horizon, trajectories=self._trajectories)
+            if histories is None:
+                return None
+            response.commit()
+        finally:
+            self._restoreDtype(saved)
+
+        if self._trajectories is None:
+            # (horizon, dimension, 1) -> (horizon, dimension)
+            histories = tuple(None if history is None else history[:,:,0] for history in histories)
+        return histories
+
+    def iterate (self,initialize=True):
+        # a generator that yields (x, y, z, u, w) at each time step without keeping the history
+        # the yielded arrays are not copied, copy them if they have to outlive the next step
+        # the noise is drawn step by step, so stopping early leaves the random streams where the last step left them
+        if self._horizon < 0:
+            return
+
+        if not self._checkModels ():
+            return
+
+        for signals in self._steps(initialize=initialize, copy=False, noise_blocks=False):
+            yield signals
+
+    def _allocateHistory (self, value):
+        if value is None:
+            return None
+        if self._trajectories is None:
+            return np.empty([self._horizon, value.shape[0]], dtype=value.dtype)
+        return np.empty([self._horizon, value.shape[0], self._trajectories], dtype=value.dtype)
+
+    def _recordHistory (self, history, t, value):
+        if self._trajectories is None:
+            history[t] = value[:,0]
+        else:
+            # the assignment broadcasts (N,1) signals shared by all trajectories
+            history[t] = value
+
+    def _steps (self,initialize=True,copy=True,noise_blocks=True):
+        # advance the simulation and yield (x, y, z, u, w) at each time step
+        # noise_blocks=True draws the noise in blocks ahead of the steps, c.f. _noiseSteps()
+        # the controller releases its resources (c.f. ControllerModel.close()) when the simulation ends or is abandoned,
+        # and the models get their own dtypes back
+        saved = self._lendDtype()
+        try:
+            for signals in self._advance(initialize=initialize, copy=copy, noise_blocks=noise_blocks):
+                yield signals
+        finally:
+            self._controller.close()
+            self._restoreDtype(saved)
+
+    def _advance (self,initialize=True,copy=True,noise_blocks=True):
+        trajectories = self._trajectories
+        if trajectories is None:
+            noise_kwargs = {}
+        else:
+            noise_kwargs = {'trajectories': trajectories}
 
-        x_history = []
-        y_history = []
-        z_history = []
-        u_history = []
-        w_history = []
+        self._convergence_iterations = []
+        self._convergence_residuals  = []
+
+        if initialize:
+            self._initializeModels()
+
+        closed_loop = self._compileClosedLoop()
+        if closed_loop is not None:
+            for signals in self._closedLoopSteps(closed_loop=closed_loop, noise_kwargs=noise_kwargs, noise_blocks=noise_blocks):
+                yield signals
+            return
 
         # In an output-feedback system, the current measurement can depend on the current control
         # while the current control also depend on the current measurement
         # e.g., y(t) = G u(t) and u(t) = K y(t)
         # therefore, we need a convergence phase for them to agree with each other
         need_convergence_phase = not self._system._state_feedback
-        y = self._system.getMeasurement()
+        loop_factorization = self._factorizeLoop() if need_convergence_phase else None
+        y = self._system.getMeasurement(copy=copy)
 
+        noise_steps = self._noiseSteps(noise_kwargs=noise_kwargs, blocks=noise_blocks)
         for t in range (self._horizon):
-            x = self._system.getState()
-            if self._noise is not None:
-                w = self._noise.getNoise()
-            else:
-                w = None
-
-            if need_convergence_phase:
-                y_convergence_prev = y
-                u_convergence = self._controller.controlConvergence(y=y_convergence_prev)
-                y_convergence = self._system.measurementConverge(u=u_convergence,w=w)
+            x = self._system.getState(copy=copy)
+            w = next(noise_steps)
 
-                while np.sum(np.square(y_convergence_prev - y_convergence)) > self._convergence_threshold:
-                    y_convergence_prev = y_convergence
-                    u_convergence = self._controller.controlConvergence(y=y_convergence_prev)
-                    y_convergence = self._system.measurementConverge(u=u_convergence,w=w)
-
-                u = self._controller.getControl(y=y_convergence)
-            else:
-                u = self._controller.getControl(y=y)
+            u = self._computeControl(
+                y=y, w=w,
+                need_convergence_phase=need_convergence_phase,
+                loop_factorization=loop_factorization
+            )
 
             self._system.systemProgress(u=u, w=w)
 
-            y = self._system.getMeasurement()
-            z = self._system.getOutput()
-
-            x_history.append(x)
-            y_history.append(y)
-            z_history.append(z)
-            u_history.append(u)
-            w_history.append(w)
-
-        return x_history, y_history, z_history, u_history, w_history
\ No newline at end of file
+            y = self._system.getMeasurement(copy=copy)
+            z = self._system.getOutput(copy=copy)
+
+            yield x, y, z, u, w
+
+        if np.any(np.array(self._convergence_residuals) > self._convergence_threshold):
+            self.warningMessage('The convergence phase stops at the maximum number of iterations before converging.')
+
+    def _noiseSteps (self,noise_kwargs,blocks=True):
+        # yield the noise of each step
+        # blocks=True draws a noise model whose blocks equal its consecutive draws (c.f. NoiseModel._block_consistent)
+        # in blocks of _noise_block_length steps, which runs ahead of the steps taken so far
+        if self._noise is None:
+            while True:
+                yield None
+        if not (blocks and self._noise._block_consistent):
+            while True:
+                yield self._noise.getNoise(**noise_kwargs)
+
+        trajectories = noise_kwargs.get('trajectories', 1)
+        remaining = self._horizon
+        while True:
+            length = max(min(self._noise_block_length, remaining), 1)
+            remaining -= length
+            for w in self._noise.generateBlock(length, trajectories=trajectories):
+                yield w
+
+    def _initializeModels (self):
+        if self._trajectories is None:
+            self._system.initialize()
+        else:
+            self._system.initialize(trajectories=self._trajectories)
+        self._controller.initialize()
+        if self._noise is not None:
+            self._noise.initialize()
+
+    def _closedLoopSteps (self,closed_loop,noise_kwargs,noise_blocks=True):
+        # advance the compiled closed loop, one product per step
+        closed_loop.initialize()
+        noise_steps = self._noiseSteps(noise_kwargs=noise_kwargs, blocks=noise_blocks)
+        try:
+            for t in range (self._horizon):
+                w = next(noise_steps)
+
+                x, y, z, u = closed_loop.step(w=w)
+
+                yield x, y, z, u, w
+        finally:
+            # keep the system and the controller consistent with the simulation
+            closed_loop.commit()
@@ -1,4 +1,5 @@
 from ..core import ControllerModel
+from ..convolution import FIR_Buffer, stack_taps
 import numpy as np
 '''
 To create a new controller model, inherit the following base function and customize the specified methods.
@@ -28,52 +29,52 @@ class IOP_FIR_Controller (ControllerModel):
         self._Y = []  # = [ Y[0], Y[1], Y[2], ... Y[FIR_horizon] ]
         self._Z = []  # = [ Z[0], Z[1], Z[2], ... Z[FIR_horizon] ]
 
-        self._delta = []
         self._hat_y = np.zeros([Ny,1])
         self._XI = []
 
-    @staticmethod
-    def _convolve(A,B,ub):
-        # perform sum_{tau = 0}^{ub-1} A[tau]B[tau]
-        if (len(A) == 0) or (len(B) == 0):
-            return 0
-
-        conv = 0
-        for tau in range(ub):
-            if (tau < len(A)) and (tau < len(B)) and (tau >= 0):
-                conv += np.dot(A[tau],B[tau])
-
-        return conv
-
-    @staticmethod
-    def _FIFO_insert(FIFO_list,element,max_size):
-        FIFO_list.insert(0,element)
-        # maintain delta length
-        while len(FIFO_list) > max_size:
-            FIFO_list.pop(-1)
-
     def initialize (self, delta0=None):
-        # empty initialization
-        self._delta = []
-        # initialize as zero
-        self._hat_y = np.zeros([self._Ny,1])
-
         # X - I
         X_len = len(self._X)
         if X_len > 0:
-            self._X0_inv = np.linalg.pinv(self._X[0])
-            self._X_delta = self._X[1:]
+            self._X0_inv = self._asDtype(np.linalg.pinv(self._X[0]))
         
         self._total = self._FIR_horizon + 1
+        self.precalculation()
+
+        # empty initialization, the past deltas are [ delta[t-1]; ... delta[t-total] ]
+        self._delta = FIR_Buffer(self._total, self._Ny, dtype=self._dtype)
+        self.__updatePast()
+
+    def precalculation(self):
+        # u[t]     = Y[0] delta[t] + [ Y[1], ..., Y[total-1], 0 ] [ delta[t-1]; ... delta[t-total] ]
+        # hat_y[t] =                 [ X[1], ..., X[total] ]      [ delta[t-1]; ... delta[t-total] ]
+        # the contributions of the past deltas are stacked into one kernel
+        total = self._total
+        self._Y_now       = self._asDtype(stack_taps(self._Y, 0, 1, (self._Nu,self._Ny)))
+        self._kernel_past = self._asDtype(np.vstack([
+            stack_taps(self._Y[:total], 1, total+1, (self._Nu,self._Ny)),
+            stack_taps(self._X,         1, total+1, (self._Ny,self._Ny))
+        ]))
+
+    def __updatePast(self):
+        past = np.dot(self._kernel_past, self._delta.window())
+        self._u_past = past[:self._Nu]
+        self._hat_y  = past[self._Nu:]
 
     def controlConvergence(self, y):
-        delta = [np.dot(self._X0_inv,y - self._hat_y)] + self._delta
-        u = self._convolve(A=self._Y,  B=delta, ub=self._total )
-        return u
+        delta = np.dot(self._X0_inv, y - self._hat_y)
+        return np.dot(self._Y_now, delta) + self._u_past
+
+    def getFeedthrough(self):
+        # u[t] = Y[0] X[0]^{-1} y[t] + ...
+        return np.dot(self._Y[0], self._X0_inv)
 
     def getControl(self, y):
         # the controller is Y X^{-1}
-        self._FIFO_insert(self._delta, np.dot(self._X0_inv,y - self._hat_y), self._total)
-        u           = self._convolve(A=self._Y,  B=self._delta, ub=self._total )
-        self._hat_y = self._convolve(A=self._X_delta, B=self._delta, ub=self._total )
-        return u
\ No newline at end of file
+        delta = np.dot(self._X0_inv, y - self._hat_y)
+        u = np.dot(self._Y_now, delta) + self._u_past
+
+        self._delta.push(delta)
+        self.__updatePast()
+
+        return u
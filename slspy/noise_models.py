@@ -8,7 +8,12 @@ class NoiseModel:
     def initialize (self):
     def getNoise (self,**kwargs):
         # the noise can depend on some parameters such as state or control
+        # a batched simulation passes trajectories=K and expects a (Nw,K) matrix
         return w
+    def generateBlock (self, horizon=1, trajectories=None):
+        # optional, the noise of the next horizon steps at once
+        # returns a (horizon,Nw) array, or (horizon,Nw,K) if trajectories=K is given
+        return block
 '''
 
 class ZeroNoise (NoiseModel):
@@ -23,33 +28,62 @@ class ZeroNoise (NoiseModel):
         self._w = np.zeros([Nw,1])
 
     def getNoise(self,**kwargs):
-        return self._w.copy()
+        trajectories = kwargs.get('trajectories',1)
+        if trajectories != 1:
+            return np.zeros([self._Nw,trajectories], dtype=self._dtype)
+        return self._asDtype(self._w.copy())
+
+    def generateBlock(self, horizon=1, trajectories=None):
+        if trajectories is None:
+            return np.zeros([horizon,self._Nw], dtype=self._dtype)
+        return np.zeros([horizon,self._Nw,trajectories], dtype=self._dtype)
 
 
 class GaussianNoise(NoiseModel):
     '''
     Generate Gaussian noise
     '''
-    def __init__ (self, Nw=0, mu=0, sigma=1):
+    _block_consistent = True
+
+    def __init__ (self, Nw=0, mu=0, sigma=1, rng=None):
         NoiseModel.__init__(self,Nw=Nw)
 
         self._mu = mu
         self._sigma = sigma
+        self.setRandomGenerator(rng)
     
     def getNoise (self,**kwargs):
-        return np.random.normal (self._mu, self._sigma, (self._Nw,1))
+        trajectories = kwargs.get('trajectories',1)
+        return self._asDtype(self._draw(
+            lambda generator, size: generator.normal(self._mu, self._sigma, size),
+            trajectories=trajectories
+        ))
+
+    def generateBlock (self, horizon=1, trajectories=None):
+        # one draw, the same values as horizon calls of getNoise()
+        block = self._asDtype(self._draw(
+            lambda generator, size: generator.normal(self._mu, self._sigma, size),
+            trajectories=1 if trajectories is None else trajectories,
+            horizon=horizon
+        ))
+        if (block is not None) and (trajectories is None):
+            return block[:,:,0]
+        return block
     
     
 class FixedNoiseVector(NoiseModel):
     '''
-    Fixed noise vector
+    Fixed noise vector, stored as a (horizon,Nw,K) block
+    _w[t] is the (Nw,K) view of the block at time t and can be modified in place
     '''
     def __init__ (self, Nw=0, horizon=0, t0=0):
         NoiseModel.__init__(self,Nw=Nw)
         self._horizon = horizon
         self._t = 0
         self._t0 = 0
+        self._block = None
         self._w = []
+        self._w_views = self._w
 
     def initialize (self):
         self.startAtTime(t=self._t0)
@@ -57,31 +91,82 @@ class FixedNoiseVector(NoiseModel):
     def startAtTime(self, t=0):
         self._t = self._t0 = t
 
-    def generateNoiseFromNoiseModelInstance (self, noise_model=None):
+    def generateNoiseFromNoiseModelInstance (self, noise_model=None, trajectories=1):
         if not isinstance (noise_model, NoiseModel):
             return
 
         self._Nw = noise_model._Nw
+        self.__setBlock(noise_model.generateBlock(self._horizon, trajectories=trajectories))
 
-        self._w = []
-        for t in range (self._horizon):
-            self._w.append(noise_model.getNoise())
-        
-    def generateNoiseFromNoiseModel (self, cls=NoiseModel):
+    def generateNoiseFromNoiseModel (self, cls=NoiseModel, trajectories=1, rng=None):
+        # rng: c.f. NoiseModel.setRandomGenerator()
         noise_model = cls(Nw=self._Nw)
-        self.generateNoiseFromNoiseModelInstance (noise_model=noise_model)
+        if rng is not None:
+            noise_model.setRandomGenerator(rng)
+        self.generateNoiseFromNoiseModelInstance (noise_model=noise_model, trajectories=trajectories)
     
     def setNoise (self,w=None):
-        # directly assign the _w vector
-        self._w = w
+        # directly assign the noise, a list of (Nw,K) matrices or a (horizon,Nw) or (horizon,Nw,K) array
+        if isinstance(w, np.ndarray):
+            self.__setBlock(w if w.ndim == 3 else w[:,:,np.newaxis])
+        else:
+            self._w = w
+            self.getBlock()
+
+    def __setBlock (self, block):
+        self._block = block
+        self._w = self._w_views = list(block)
+
+    def __getstate__ (self):
+        # pickle the block only, the views of _w would be pickled as separate copies
+        self.getBlock()
+        state = self.__dict__.copy()
+        del state['_w'], state['_w_views']
+        return state
+
+    def __setstate__ (self, state):
+        # a noise pickled before the block existed has only _w
+        w = state.pop('_w', None)
+        state.pop('_w_views', None)
+        self.__dict__.update(state)
+        if w is None:
+            self.__setBlock(state['_block'] if state.get('_block') is not None else np.zeros([0,self._Nw,1]))
+        else:
+            self._block = None
+            self._w = self._w_views = w
+            self.getBlock()
+
+    def getBlock (self):
+        # the stored (horizon,Nw,K) block, rebuilt if _w has been reassigned
+        w = self._w
+        if (self._block is None) or (w is not self._w_views) or any(a is not b for a, b in zip(w, self._w_views)):
+            self.__setBlock(np.stack([np.asarray(sample) for sample in w]) if len(w) > 0 else np.zeros([0,self._Nw,1]))
+        return self._block
+
+    def generateBlock (self, horizon=1, trajectories=None):
+        # the next horizon steps of the stored noise (zeros after its end), advances the time as getNoise() does
+        K = 1 if trajectories is None else trajectories
+        stored = self.getBlock()
+        available = max(min(horizon, self._horizon - self._t, stored.shape[0] - self._t), 0)
+        if (available > 0) and (stored.shape[2] not in (1, K)):
+            self.errorMessage('The stored noise does not fit the trajectories.')
+            return None
+        block = np.zeros([horizon, self._Nw, K], dtype=self._dtype if self._dtype is not None else stored.dtype)
+        block[:available] = stored[self._t:self._t+available]
+        self._t += available
+        return block[:,:,0] if trajectories is None else block
 
     def getNoise (self,**kwargs):
+        trajectories = kwargs.get('trajectories',1)
         if self._t < self._horizon:
             w = self._w[self._t]
             self._t += 1
-            return w
+            if (trajectories != 1) and (w.shape[1] == 1):
+                # share a single stored realization among all trajectories
+                w = np.repeat(w, trajectories, axis=1)
+            return self._asDtype(w)
 
-        return np.zeros((self._Nw,1))
+        return np.zeros((self._Nw,trajectories), dtype=self._dtype)
 
 
 class MixedNoise(NoiseModel):
@@ -96,6 +181,20 @@ class MixedNoise(NoiseModel):
         for noise_model in self._noise_models:
             noise_model.initialize()
 
+    def setDtype(self, dtype=None):
+        NoiseModel.setDtype(self, dtype)
+        for noise_model in self._noise_models:
+            noise_model.setDtype(dtype)
+
+    def _dtypes(self):
+        return NoiseModel._dtypes(self) + [entry for noise_model in self._noise_models for entry in noise_model._dtypes()]
+
+    def setRandomGenerator(self, rng=None):
+        # the noise models draw from the shared generator(s) in order
+        NoiseModel.setRandomGenerator(self, rng)
+        for noise_model in self._noise_models:
+            noise_model._rng = self._rng
+
 
 class MixedNoiseConcat(MixedNoise):
     '''
@@ -113,6 +212,12 @@ class MixedNoiseConcat(MixedNoise):
             totalNoise.append(noise_model.getNoise(**kwargs))
         return np.concatenate(totalNoise)
 
+    def generateBlock(self, horizon=1, trajectories=None):
+        return np.concatenate(
+            [noise_model.generateBlock(horizon, trajectories=trajectories) for noise_model in self._noise_models],
+            axis=1
+        )
+
 
 class MixedNoiseAdd(MixedNoise):
     '''
@@ -123,7 +228,61 @@ class MixedNoiseAdd(MixedNoise):
         MixedNoise.__init__(self, Nw, *argv)
             
     def getNoise(self, **kwargs):
-        totalNoise = np.zeros((self._Nw, 1))
+        totalNoise = np.zeros((self._Nw, kwargs.get('trajectories',1)), dtype=self._dtype)
         for noise_model in self._noise_models:
             totalNoise += noise_model.getNoise(**kwargs)
-        return totalNoise
\ No newline at end of file
+        return totalNoise
+
+    def generateBlock(self, horizon=1, trajectories=None):
+        shape = [horizon, self._Nw] + ([] if trajectories is None else [trajectories])
+        totalNoise = np.zeros(shape, dtype=self._dtype)
+        for noise_model in self._noise_models:
+            totalNoise += noise_model.generateBlock(horizon, trajectories=trajectories)
+        return totalNoise
+
+
+class Replicated_Noise (NoiseModel):
+    '''
+    One draw of the noise of K trajectories (None: a single trajectory), repeated for each of the copies,
+    i.e., the (Nw,K) noise becomes (Nw,copies*K), c.f. Lockstep_Controllers
+    '''
+    def __init__ (self, noise=None, copies=1, trajectories=None):
+        NoiseModel.__init__(self, Nw=noise._Nw)
+        self._noise = noise
+        self._copies = copies
+        self._trajectories = trajectories
+        self._block_consistent = noise._block_consistent
+
+    def setDtype (self, dtype=None):
+        NoiseModel.setDtype(self, dtype)
+        self._noise.setDtype(dtype)
+
+    def _dtypes (self):
+        return NoiseModel._dtypes(self) + self._noise._dtypes()
+
+    def initialize (self):
+        self._noise.initialize()
+
+    def __kwargs (self):
+        return {} if self._trajectories is None else {'trajectories': self._trajectories}
+
+    def __checkTrajectories (self, trajectories):
+        # the caller asks for all the copies at once
+        if (trajectories is not None) and (trajectories != self._copies*(self._trajectories or 1)):
+            return self.errorMessage('The noise has %d trajectories (%d copies), not %d.' % (
+                self._copies*(self._trajectories or 1), self._copies, trajectories))
+        return True
+
+    def getNoise (self, **kwargs):
+        if not self.__checkTrajectories(kwargs.get('trajectories')):
+            return None
+        w = np.broadcast_to(self._noise.getNoise(**self.__kwargs()), (self._Nw, self._trajectories or 1))
+        return np.tile(w, (1, self._copies))
+
+    def generateBlock (self, horizon=1, trajectories=None):
+        if not self.__checkTrajectories(trajectories):
+            return None
+        block = self._noise.generateBlock(horizon, **self.__kwargs())
+        if self._trajectories is None:
+            block = block[:,:,np.newaxis]
+        return np.tile(block, (1, 1, self._copies))
@@ -0,0 +1,34 @@
+import numpy as np
+'''
+Independent, reproducible random streams for noise models and plant generators
+
+A seed is an int, a numpy.random.SeedSequence, or a numpy.random.Generator.
+The streams spawned from a seed depend only on the seed and their indices,
+so a run that draws trajectory k (or grid point k) from stream k is reproducible
+regardless of how the trajectories are batched or distributed over processes.
+'''
+
+def as_generator (seed=None):
+    '''
+    The numpy.random.Generator of the seed, None stays None (the global numpy.random state)
+    '''
+    if (seed is None) or isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed)
+
+def spawn_seeds (seed=None, streams=1):
+    '''
+    A list of independent SeedSequences, one per stream (worker, trajectory, grid point, ...)
+    '''
+    if isinstance(seed, np.random.Generator):
+        # the child streams of the generator's own seed sequence
+        return seed.bit_generator.seed_seq.spawn(streams)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(streams)
+
+def spawn_generators (seed=None, streams=1):
+    '''
+    A list of independent Generators, one per stream
+    '''
+    return [np.random.default_rng(child) for child in spawn_seeds(seed=seed, streams=streams)]
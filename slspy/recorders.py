@@ -0,0 +1,227 @@
+from .core import ObjBase
+import numpy as np
+import json
+import os
+'''
+On-disk records of simulations that do not fit in memory
+
+    Trajectory_Recorder: written by Simulator.run(recorder=...) one time step at a time
+    Trajectory_Reader:   reads a record lazily, time windows are sliced without loading the whole run
+
+A record is a directory with one chunked array per signal:
+    meta.json       the decimation, the chunk length, and the shape, dtype and length of each signal
+    x_000000.npy    the recorded x at the first chunk_length recorded time steps
+    x_000001.npy    ...
+The chunks are .npy files written and read through memory maps.
+'''
+
+_SIGNALS = ('x', 'y', 'z', 'u', 'w')
+
+class Trajectory_Recorder (ObjBase):
+    '''
+    Record (x, y, z, u, w) of every decimation-th time step into memory-mapped chunks
+    '''
+    def __init__ (self, path=None, decimation=1, chunk_length=4096):
+        self._path = path
+        self._decimation = max(int(decimation), 1)
+        self._chunk_length = max(int(chunk_length), 1)
+
+        self._squeeze = True
+        self._t = 0        # the number of time steps offered to record()
+        self._length = 0   # the number of recorded time steps
+        self._signals = {} # name -> (row shape, dtype), None for a signal that is not available
+        self._chunks = {}  # name -> the memory map of the current chunk
+
+    def initialize (self, trajectories=None):
+        # start a new record, the chunks of the previous record in the directory are removed
+        # trajectories=None records each signal as rows of shape (N,), otherwise (N,trajectories)
+        if self._path is None:
+            return self.errorMessage('The path of the record is not set.')
+        self.close()
+
+        os.makedirs(self._path, exist_ok=True)
+        for file_name in os.listdir(self._path):
+            if file_name == 'meta.json' or (file_name.endswith('.npy') and file_name.split('_')[0] in _SIGNALS):
+                os.remove(os.path.join(self._path, file_name))
+
+        self._squeeze = trajectories is None
+        self._t = 0
+        self._length = 0
+        self._signals = {}
+        self._chunks = {}
+        return True
+
+    def record (self, x=None, y=None, z=None, u=None, w=None):
+        # offer the signals of one time step, only every decimation-th time step is written
+        t = self._t
+        self._t += 1
+        if t % self._decimation != 0:
+            return
+
+        row = self._length % self._chunk_length
+        if (row == 0) or (not self._chunks):
+            self.__openChunks(x=x, y=y, z=z, u=u, w=w)
+
+        for name, value in zip(_SIGNALS, (x, y, z, u, w)):
+            chunk = self._chunks.get(name)
+            if chunk is None:
+                continue
+            if self._squeeze:
+                chunk[row] = value[:,0]
+            else:
+                # the assignment broadcasts (N,1) signals shared by all trajectories
+                chunk[row] = value
+
+        self._length += 1
+
+    def __openChunks (self, **signals):
+        # map the chunks that hold the next recorded time step
+        self.__flushChunks()
+        if self._length == 0:
+            for name in _SIGNALS:
+                value = signals[name]
+                if value is None:
+                    self._signals[name] = None
+                else:
+                    shape = value.shape[:1] if self._squeeze else value.shape
+                    self._signals[name] = (shape, value.dtype)
+
+        index = self._length // self._chunk_length
+        new_chunk = (self._length % self._chunk_length == 0)
+        for name, signal in self._signals.items():
+            if signal is None:
+                continue
+            shape, dtype = signal
+            if new_chunk:
+                self._chunks[name] = np.lib.format.open_memmap(
+                    self.__chunkFile(name, index),
+                    mode='w+',
+                    dtype=dtype,
+                    shape=(self._chunk_length,) + tuple(shape)
+                )
+            else:
+                # continue a partially filled chunk after close()
+                self._chunks[name] = np.load(self.__chunkFile(name, index), mmap_mode='r+')
+        self.__writeMeta()
+
+    def __flushChunks (self):
+        for chunk in self._chunks.values():
+            chunk.flush()
+        self._chunks = {}
+
+    def close (self):
+        # flush the record to the disk, a later record() continues the record
+        if not self._chunks:
+            return
+        self.__flushChunks()
+        self.__writeMeta()
+
+    def __chunkFile (self, name, index):
+        return os.path.join(self._path, '%s_%06d.npy' % (name, index))
+
+    def __writeMeta (self):
+        meta = {
+            'decimation': self._decimation,
+            'chunk_length': self._chunk_length,
+            'length': self._length,
+            'signals': {
+                name: None if signal is None else {
+                    'shape': list(signal[0]),
+                    'dtype': np.dtype(signal[1]).str
+                }
+                for name, signal in self._signals.items()
+            }
+        }
+        with open(os.path.join(self._path, 'meta.json'), 'w') as meta_file:
+            json.dump(meta, meta_file)
+
+    def getLength (self):
+        return self._length
+
+    def getReader (self):
+        self.close()
+        return Trajectory_Reader(path=self._path)
+
+
+class Trajectory_Reader (ObjBase):
+    '''
+    Lazy access to a record written by Trajectory_Recorder, e.g.,
+        reader = Trajectory_Reader(path)
+        x = reader['x'][1000:2000]  # loads only the chunks that cover the window
+        t = reader.getTimes()[1000:2000]
+    '''
+    def __init__ (self, path=None):
+        self._path = path
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        self._decimation = meta['decimation']
+        self._chunk_length = meta['chunk_length']
+        self._length = meta['length']
+        self._signals = meta['signals']
+
+    def __len__ (self):
+        return self._length
+
+    def getSignals (self):
+        # the names of the recorded signals
+        return [name for name in _SIGNALS if self._signals.get(name) is not None]
+
+    def getTimes (self):
+        # the time steps of the recorded rows
+        return np.arange(self._length) * self._decimation
+
+    def __getitem__ (self, name):
+        signal = self._signals.get(name)
+        if signal is None:
+            return None
+        return Recorded_Signal(
+            path=self._path,
+            name=name,
+            length=self._length,
+            chunk_length=self._chunk_length,
+            shape=tuple(signal['shape']),
+            dtype=np.dtype(signal['dtype'])
+        )
+
+
+class Recorded_Signal:
+    '''
+    A signal of a record, indexed like an array of shape (length, N) or (length, N, trajectories)
+    '''
+    def __init__ (self, path, name, length, chunk_length, shape, dtype):
+        self._path = path
+        self._name = name
+        self._length = length
+        self._chunk_length = chunk_length
+        self.shape = (length,) + shape
+        self.dtype = dtype
+
+    def __len__ (self):
+        return self._length
+
+    def __array__ (self, dtype=None, copy=None):
+        out = self[:]
+        return out if dtype is None else out.astype(dtype)
+
+    def __getitem__ (self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        time_index, rest = index[0], index[1:]
+
+        if isinstance(time_index, slice):
+            rows = np.arange(self._length)[time_index]
+        else:
+            rows = np.arange(self._length)[np.atleast_1d(time_index)]
+
+        out = np.empty((len(rows),) + self.shape[1:], dtype=self.dtype)
+        chunks = rows // self._chunk_length
+        for chunk in np.unique(chunks):
+            selected = (chunks == chunk)
+            data = np.load(os.path.join(self._path, '%s_%06d.npy' % (self._name, chunk)), mmap_mode='r')
+            out[selected] = data[rows[selected] - chunk * self._chunk_length]
+
+        if rest:
+            out = out[(slice(None),) + rest]
+        if not isinstance(time_index, slice) and np.ndim(time_index) == 0:
+            out = out[0]
+        return out
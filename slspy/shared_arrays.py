@@ -0,0 +1,179 @@
+from .core import ObjBase
+from .system_models import LTI_System
+from .noise_models import FixedNoiseVector
+import numpy as np
+import copy
+import os
+import uuid
+from multiprocessing import shared_memory
+'''
+Publish large arrays (plant matrices, Phi taps, noise blocks) once for all worker processes.
+
+A Shared_Array_Store copies the arrays into shared memory, or into memory-mapped .npy files if a path is given,
+and returns copies of the models whose arrays are Shared_Array views of the published data,
+the given models keep their own arrays.
+A Shared_Array (and any view of it) pickles as a reference, so a worker that unpickles a model
+attaches read-only views by name instead of receiving copies:
+
+    with Shared_Array_Store() as store:
+        shared = (store.shareSystem(sys), store.shareController(controller), store.shareNoise(noise))
+        results = executor.map(work, [shared] * n)  # the matrices are not copied
+
+The arrays stay published until the store is closed, so the shared models must not be used afterwards,
+neither by the workers nor by this process.
+'''
+
+# the shared memory segments / memory maps attached by this process, name -> (segment, root array)
+_attached = {}
+
+class Shared_Array (np.ndarray):
+    '''
+    A numpy array that lives in a published segment and pickles as a reference to it
+    '''
+    def __array_finalize__ (self, obj):
+        # views (slices, transposes, ...) keep the segment they live in
+        self._shared_root = getattr(obj, '_shared_root', None)
+
+    def __array_wrap__ (self, obj, context=None, return_scalar=False):
+        # the results of computations are ordinary arrays
+        if return_scalar:
+            return obj[()]
+        return obj.view(np.ndarray) if isinstance(obj, np.ndarray) else obj
+
+    def __reduce__ (self):
+        root = self._shared_root
+        if root is not None:
+            kind, name, address, nbytes = root
+            offset = self.__array_interface__['data'][0] - address
+            if 0 <= offset < nbytes or self.size == 0:
+                return (_attach, (kind, name, self.dtype.str, self.shape, self.strides, max(offset, 0)))
+        # not inside a published segment: pickle a copy
+        return np.asarray(self).view(np.ndarray).__reduce__()
+
+def _root (kind, name, segment_array):
+    array = segment_array.view(Shared_Array)
+    array._shared_root = (kind, name, array.__array_interface__['data'][0], array.nbytes)
+    return array
+
+def _attach (kind, name, dtype, shape, strides, offset):
+    # a read-only view of a published segment, attached once per process
+    if name not in _attached:
+        if kind == 'shm':
+            # the owner unlinks the segment, the attaching process must not
+            try:
+                segment = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                # python < 3.13 registers the segment again, with the resource tracker
+                # the worker processes inherit from the owner, which unlinks it only once
+                segment = shared_memory.SharedMemory(name=name)
+            data = np.ndarray((segment.size,), dtype=np.uint8, buffer=segment.buf)
+        else:
+            segment = None
+            data = np.load(name, mmap_mode='r').reshape(-1).view(np.uint8)
+        data.flags.writeable = False
+        _attached[name] = (segment, _root(kind, name, data))
+    root = _attached[name][1]
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=root, offset=offset, strides=strides).view(Shared_Array)
+    array._shared_root = root._shared_root
+    return array
+
+class Shared_Array_Store (ObjBase):
+    '''
+    The owner of the published arrays
+    path=None publishes into shared memory, otherwise into memory-mapped .npy files in the directory
+    '''
+    def __init__ (self, path=None):
+        self._path = path
+        self._segments = []  # (kind, segment or file name)
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *args):
+        self.close()
+
+    def share (self, array):
+        # publish a copy of the array and return it as a Shared_Array
+        array = np.ascontiguousarray(array)
+        if self._path is None:
+            segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            name = segment.name
+            self._segments.append(('shm', segment))
+            data = np.ndarray((segment.size,), dtype=np.uint8, buffer=segment.buf)
+            _attached[name] = (segment, _root('shm', name, data))
+            kind = 'shm'
+        else:
+            name = os.path.join(self._path, uuid.uuid4().hex + '.npy')
+            data = np.lib.format.open_memmap(name, mode='w+', dtype=np.uint8, shape=(max(array.nbytes, 1),))
+            self._segments.append(('file', name))
+            _attached[name] = (None, _root('file', name, data))
+            kind = 'file'
+
+        shared = _attach(kind, name, array.dtype.str, array.shape, array.strides, 0)
+        # the owner fills the segment
+        writable = np.ndarray(array.shape, dtype=array.dtype, buffer=data)
+        writable[...] = array
+        return shared
+
+    def shareTaps (self, taps):
+        # publish a list of equally-shaped matrices as one block, return the list of its views
+        # entries that are not arrays (e.g., None) are kept as they are
+        indices = [i for i, tap in enumerate(taps) if isinstance(tap, np.ndarray)]
+        if len(indices) == 0 or any(taps[i].shape != taps[indices[0]].shape for i in indices):
+            return [self.share(tap) if isinstance(tap, np.ndarray) else tap for tap in taps]
+        block = self.share(np.stack([taps[i] for i in indices]))
+        shared = list(taps)
+        for k, i in enumerate(indices):
+            shared[i] = block[k]
+        return shared
+
+    def shareAttributes (self, obj, names):
+        # return a shallow copy of obj whose array (or list of arrays) attributes are the published views,
+        # obj is left unchanged, and sparse matrices are kept as they are
+        shared = copy.copy(obj)
+        for name in names:
+            value = getattr(obj, name, None)
+            if isinstance(value, np.ndarray) and not isinstance(value, Shared_Array):
+                setattr(shared, name, self.share(value))
+            elif isinstance(value, list):
+                setattr(shared, name, self.shareTaps(value))
+        return shared
+
+    def shareSystem (self, system):
+        if not isinstance(system, LTI_System):
+            return self.errorMessage('Only the matrices of LTI_System can be shared.')
+        return self.shareAttributes(system, list(LTI_System._matrices))
+
+    def shareController (self, controller):
+        # the taps of SLS (state-/output-feedback) and IOP FIR controllers
+        return self.shareAttributes(controller, [
+            '_Phi_x', '_Phi_u',
+            '_Phi_xx', '_Phi_ux', '_Phi_xy', '_Phi_uy',
+            '_X', '_W', '_Y', '_Z'
+        ])
+
+    def shareNoise (self, noise):
+        if not isinstance(noise, FixedNoiseVector):
+            return self.errorMessage('Only the block of FixedNoiseVector can be shared.')
+        shared = copy.copy(noise)
+        shared.setNoise(self.share(noise.getBlock()))
+        return shared
+
+    def close (self):
+        # unpublish the arrays, the views in this process must not be used afterwards
+        for kind, segment in self._segments:
+            if kind == 'shm':
+                _attached.pop(segment.name, None)
+                segment.unlink()
+                try:
+                    segment.close()
+                except BufferError:
+                    # views of the segment are still alive, the memory is released with them
+                    pass
+            else:
+                _attached.pop(segment, None)
+                if os.path.exists(segment):
+                    os.remove(segment)
+        self._segments = []
@@ -1,6 +1,7 @@
 from .components import SLS_Constraint
 import cvxpy as cp
 import numpy as np
+import scipy.sparse as sp
 '''
 To create a new SLS constraint, inherit the following base function and customize the specified methods.
 
@@ -128,11 +129,18 @@ class SLS_Cons_dLocalized (SLS_Constraint):
         Phi_x = sls._Phi_x
         Phi_u = sls._Phi_u
 
-        commsAdj = np.absolute(sls._system_model._A) > 0
+        A  = sls._system_model._A
+        B2 = sls._system_model._B2
+        if sp.issparse(A):
+            A = A.toarray()
+        if sp.issparse(B2):
+            B2 = B2.toarray()
+
+        commsAdj = np.absolute(A) > 0
         localityR = np.linalg.matrix_power(commsAdj, self._d - 1) > 0
 
         # performance helpers
-        absB2T = np.absolute(sls._system_model._B2).T
+        absB2T = np.absolute(B2).T
 
         # adjacency matrix for available information 
         info_adj = np.eye(sls._system_model._Nx) > 0
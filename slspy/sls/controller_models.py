@@ -1,5 +1,8 @@
 from ..core import ControllerModel
+from ..convolution import FIR_Buffer, stack_taps
 import numpy as np
+import scipy.sparse as sp
+from concurrent.futures import ThreadPoolExecutor
 '''
 To create a new controller model, inherit the following base function and customize the specified methods.
 
@@ -17,6 +20,16 @@ class SLS_FIR_Controller (ControllerModel):
     '''
     Base for SLS FIR controllers
     '''
+    # the defaults of setSparseExecution(), also for controllers pickled before the setting existed
+    _sparse_execution = 'auto'
+    _sparse_tolerance = 0
+    # 'auto' uses sparse kernels if the taps have at least _sparse_min_entries entries
+    # and at most the fraction _sparse_max_density of them are nonzero:
+    # below that size, or above that density, the CSR overhead outweighs the saved products
+    _sparse_min_entries = 4096
+    _sparse_max_density = 0.25
+    _use_sparse = False
+
     def __init__ (self, Nx=0, Nu=0, FIR_horizon=1):
         self._Nx = Nx # dimension of state
         self._Nu = Nu # dimension of control
@@ -25,14 +38,74 @@ class SLS_FIR_Controller (ControllerModel):
 
         self._Phi_x = []  # = [ 0, Phi_x[1], Phi_x[2], ... Phi_x[FIR_horizon] ]
         self._Phi_u = []  # = [ 0, Phi_u[1], Phi_u[2], ... Phi_u[FIR_horizon] ]
-        self._delta = []
         self._hat_x = np.zeros([Nx,1])
 
         self._u = np.zeros([self._Nu,1])
 
+        self.setSparseExecution()
+
     def initialize (self, delta0=None):
         pass
 
+    def setSparseExecution (self, sparse_execution='auto', tolerance=0, min_entries=4096, max_density=0.25):
+        # 'auto': use sparse kernels if the support of the taps is sparse enough, e.g., for d-localized controllers,
+        #         i.e., the taps have at least min_entries entries and at most the fraction max_density is nonzero
+        # True:   always use sparse (CSR) kernels
+        # False:  always use dense kernels
+        # the entries of the taps with magnitudes no larger than tolerance are treated as structural zeros
+        # the setting takes effect at the next initialize()
+        self._sparse_execution = sparse_execution
+        self._sparse_tolerance = tolerance
+        self._sparse_min_entries = min_entries
+        self._sparse_max_density = max_density
+        self._use_sparse = False
+
+    def isSparseExecution (self):
+        return self._use_sparse
+
+    def _detectSupport (self, *tap_lists):
+        # return whether the kernels built from the taps are stored as CSR
+        if self._sparse_execution != 'auto':
+            return bool(self._sparse_execution)
+
+        nonzeros = 0
+        entries = 0
+        for taps in tap_lists:
+            for tap in taps:
+                if tap is None:
+                    continue
+                nonzeros += np.count_nonzero(np.absolute(tap) > self._sparse_tolerance)
+                entries  += tap.size
+        # sparse products only pay off for large kernels with few nonzeros
+        return (entries >= self._sparse_min_entries) and (nonzeros <= self._sparse_max_density * entries)
+
+    def _kernelTaps(self, A, lb, ub, shape, sparse=None):
+        # the concatenated taps [ A[lb], ..., A[ub-1] ] in the storage decided by _detectSupport
+        # sparse=None uses the storage of the current kernels
+        if sparse is None:
+            sparse = self._use_sparse
+        if not sparse:
+            kernel = self._concatenate_taps(A, lb, ub, shape)
+            if self._sparse_tolerance > 0:
+                kernel = np.where(np.absolute(kernel) > self._sparse_tolerance, kernel, 0)
+            return kernel
+
+        taps = []
+        for tau in range(lb,ub):
+            if (tau < len(A)) and (A[tau] is not None):
+                tap = np.where(np.absolute(A[tau]) > self._sparse_tolerance, A[tau], 0)
+                taps.append(sp.csr_matrix(tap))
+            else:
+                taps.append(sp.csr_matrix(shape))
+        if len(taps) == 0:
+            return sp.csr_matrix((shape[0],0))
+        return sp.hstack(taps, format='csr')
+
+    def _stackKernels(self, kernels, sparse=None):
+        if self._use_sparse if sparse is None else sparse:
+            return self._asDtype(sp.vstack(kernels, format='csr'))
+        return self._asDtype(np.vstack(kernels))
+
     def controlConvergence(self, y):
         # zero control
         return self._u
@@ -42,24 +115,14 @@ class SLS_FIR_Controller (ControllerModel):
         return self._u
 
     @staticmethod
-    def _convolve(A,B,lb,ub,offset):
-        # perform sum_{tau = lb}^{ub-1} A[tau]B[tau-offset]
-        if (len(A) == 0) or (len(B) == 0):
-            return 0
-
-        conv = 0
-        for tau in range(lb,ub):
-            if (tau < len(A)) and (tau-offset < len(B)) and (tau-offset >= 0):
-                conv += np.dot(A[tau],B[tau-offset])
-
-        return conv
+    def _concatenate_taps(A,lb,ub,shape):
+        # return [ A[lb], A[lb+1], ..., A[ub-1] ] as a matrix, the missing taps are zeros
+        return stack_taps(A, lb, ub, shape)
 
     @staticmethod
-    def _FIFO_insert(FIFO_list,element,max_size):
-        FIFO_list.insert(0,element)
-        # maintain delta length
-        while len(FIFO_list) > max_size:
-            FIFO_list.pop(-1)
+    def _shift_matrix(blocks,size):
+        # the sparse matrix that shifts [ v[0]; v[1]; ... ] down by one block of the given size
+        return sp.eye(blocks*size, k=-size, format='csr')
 
 # we don't combine the state-feedback and non-state-feedback controllers using a switch due to performance
 class SLS_StateFeedback_FIR_Controller (SLS_FIR_Controller):
@@ -67,36 +130,268 @@ class SLS_StateFeedback_FIR_Controller (SLS_FIR_Controller):
     State feedback SLS controller with finite impulse response
     '''
     def initialize (self, delta0=None):
+        self.precalculation()
+
         # empty initialization
-        self._delta = []
+        self._delta = FIR_Buffer(self._FIR_horizon-1, self._Nx, dtype=self._dtype)
         if delta0 is not None:
             if isinstance (delta0,list):
-                for delta in delta0:
+                # delta0 = [ delta[t-1], delta[t-2], ... ]
+                for delta in reversed(delta0[:self._FIR_horizon-1]):
                     self.__addDeltaIfValid(delta)
             else:
                 self.__addDeltaIfValid(delta0)
 
-        # initialize as zero
-        self._hat_x = np.zeros([self._Nx,1])
-    
+        self._updatePast()
+
     def __addDeltaIfValid(self,delta=None):
         # check if the content is valid
         if ((delta.shape[0] == self._Nx) and
             (delta.shape[1] == 1)):
-            self._delta.append(delta)
+            self._delta.push(delta)
+
+    def precalculation(self):
+        self._use_sparse, self._Phi_u_now, self._kernel_past = self._kernels()
+
+    def _kernels(self):
+        # return (sparse, Phi_u_now, kernel_past) of the current taps without storing them
+        H  = self._FIR_horizon
+        Nx = self._Nx
+        Nu = self._Nu
+
+        # u[t]     = Phi_u[1] delta[t] + Phi_u[2:] [ delta[t-1]; ... ]
+        # hat_x[t] =                     Phi_x[2:] [ delta[t-1]; ... ]
+        # the contributions of the past deltas are stacked into one kernel
+        sparse = self._detectSupport(self._Phi_x, self._Phi_u)
+        Phi_u_now   = self._asDtype(self._kernelTaps(self._Phi_u, 1, 2, (Nu,Nx), sparse=sparse))
+        kernel_past = self._stackKernels([
+            self._kernelTaps(self._Phi_u, 2, H+1, (Nu,Nx), sparse=sparse),
+            self._kernelTaps(self._Phi_x, 2, H+1, (Nx,Nx), sparse=sparse)
+        ], sparse=sparse)
+        return sparse, Phi_u_now, kernel_past
+
+    def _updatePast(self):
+        # the contributions of the past deltas to u and hat_x
+        past = self._kernel_past.dot(self._delta.window())
+        self._u_past = past[:self._Nu]
+        self._hat_x  = past[self._Nu:]
 
     def controlConvergence(self, y):
-        delta = [y - self._hat_x] + self._delta
-        u = self._convolve(A=self._Phi_u, B=delta, lb=1, ub=self._FIR_horizon+1, offset=1)
+        return self._Phi_u_now.dot(y - self._hat_x) + self._u_past
+
+    def getControl(self, y):
+        delta = y - self._hat_x
+        u = self._Phi_u_now.dot(delta) + self._u_past
+
+        self._delta.push(delta)
+        self._updatePast()
+
+        return u
+
+    def getFeedthrough(self):
+        # u[t] = Phi_u[1] y[t] + ...
+        return self._concatenate_taps(self._Phi_u, 1, 2, (self._Nu,self._Nx))
+
+    def getStateSpaceRealization(self):
+        '''
+        xi = [ delta[t-1]; delta[t-2]; ... delta[t-FIR_horizon+1] ]
+        delta[t] = y[t] - Phi_x[2:] xi
+        u[t]     = Phi_u[1] delta[t] + Phi_u[2:] xi
+        '''
+        H  = self._FIR_horizon
+        Nx = self._Nx
+
+        # the kernels of the current taps, which are sparse for localized controllers
+        # they are built aside, the state of the controller is not changed
+        _, Phi_u_1, kernel_past = self._kernels()
+        Phi_u_tail = kernel_past[:self._Nu]
+        Phi_x_tail = kernel_past[self._Nu:]
+
+        # delta[t] enters the shift register of past deltas
+        if H > 1:
+            shift = self._shift_matrix(H-1,Nx)
+            Ak = sp.vstack([-Phi_x_tail, shift[Nx:]], format='csr')
+            Bk = sp.vstack([np.eye(Nx), sp.csr_matrix(((H-2)*Nx,Nx))], format='csr')
+        else:
+            Ak = sp.csr_matrix((0,0))
+            Bk = sp.csr_matrix((0,Nx))
+        Ck = Phi_u_tail - Phi_u_1 @ Phi_x_tail
+        Dk = Phi_u_1
+
+        return Ak, Bk, Ck, Dk
+
+    def getRealizationState(self):
+        return self._delta.window()
+
+    def setRealizationState(self, xi):
+        self._delta.setWindow(xi)
+        self._updatePast()
+
+class SLS_Partitioned_StateFeedback_FIR_Controller (SLS_StateFeedback_FIR_Controller):
+    '''
+    State feedback SLS controller executed as one sub-controller per subsystem (node or cluster).
+    Each sub-controller owns some rows of x and u and only reads the neighborhood of delta
+    in the support of its Phi rows, as in the distributed implementation of a localized controller.
+    The sub-controllers are evaluated concurrently on a thread pool sharing the same arrays.
+    The threads are started at the first step and released by close(), which the simulator calls
+    at the end of each simulation; the controller can also be used as a context manager.
+
+        controller = SLS_Partitioned_StateFeedback_FIR_Controller.fromController(
+            synthesizer.synthesizeControllerModel(), workers=4
+        )
+    '''
+    def __init__ (self, Nx=0, Nu=0, FIR_horizon=1, partitions=None, workers=None):
+        SLS_StateFeedback_FIR_Controller.__init__(self, Nx=Nx, Nu=Nu, FIR_horizon=FIR_horizon)
+        self._executor = None
+        self.setPartitions(partitions=partitions, workers=workers)
+
+    @classmethod
+    def fromController (cls, controller=None, partitions=None, workers=None):
+        # the partitioned execution of a synthesized SLS_StateFeedback_FIR_Controller, which is not changed
+        # the taps are shared with the controller
+        if not isinstance(controller, SLS_StateFeedback_FIR_Controller):
+            return None
+        partitioned = cls(Nx=controller._Nx, Nu=controller._Nu, FIR_horizon=controller._FIR_horizon, partitions=partitions, workers=workers)
+        partitioned._Phi_x = list(controller._Phi_x)
+        partitioned._Phi_u = list(controller._Phi_u)
+        partitioned.setSparseExecution(
+            sparse_execution=controller._sparse_execution, tolerance=controller._sparse_tolerance,
+            min_entries=controller._sparse_min_entries, max_density=controller._sparse_max_density
+        )
+        partitioned.setDtype(controller.getDtype())
+        return partitioned
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *args):
+        self.close()
+
+    def setPartitions (self, partitions=None, workers=None):
+        # partitions = [ (state indices, control indices), ... ], e.g., [ ([i],[i]) for i in range(N) ] for one node each
+        # None splits x and u evenly into max(workers,1) contiguous clusters
+        # workers: the number of threads, None or 1 evaluates the partitions sequentially
+        # the setting takes effect at the next initialize()
+        self._partition_spec = partitions
+        self._workers = workers
+        self.close()
+
+    def __getstate__ (self):
+        # the worker threads are not copied, they are recreated at the next step
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+    def close (self):
+        # release the worker threads, the next step starts them again
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def getPartitions (self):
+        # return [ (state indices, control indices, neighborhood of delta), ... ]
+        return [
+            (partition[0], partition[1], np.union1d(partition[3], partition[6] % self._Nx))
+            for partition in self._partitions
+        ]
+
+    def __makePartitions (self):
+        if self._partition_spec is None:
+            clusters = max(self._workers or 1, 1)
+            return list(zip(
+                np.array_split(np.arange(self._Nx), clusters),
+                np.array_split(np.arange(self._Nu), clusters)
+            ))
+
+        partitions = [
+            (np.asarray(x_indices, dtype=int).ravel(), np.asarray(u_indices, dtype=int).ravel())
+            for x_indices, u_indices in self._partition_spec
+        ]
+        x_indices = np.sort(np.concatenate([partition[0] for partition in partitions]))
+        u_indices = np.sort(np.concatenate([partition[1] for partition in partitions]))
+        if (not np.array_equal(x_indices, np.arange(self._Nx))) or (not np.array_equal(u_indices, np.arange(self._Nu))):
+            self.errorMessage('The partitions must cover each state and control exactly once, use a single partition instead.')
+            return [(np.arange(self._Nx), np.arange(self._Nu))]
+        return partitions
+
+    @staticmethod
+    def __localize (kernel):
+        # restrict the kernel to the columns in its support
+        if sp.issparse(kernel):
+            columns = np.unique(kernel.indices)
+        else:
+            columns = np.flatnonzero(np.any(kernel != 0, axis=0))
+        return kernel[:, columns], columns
+
+    def precalculation(self):
+        SLS_StateFeedback_FIR_Controller.precalculation(self)
+
+        # each partition computes its rows of u and of [ u_past; hat_x ]
+        Nx = self._Nx
+        Nu = self._Nu
+        if self._use_sparse:
+            Phi_u_now   = sp.csr_matrix(self._Phi_u_now)
+            kernel_past = sp.csr_matrix(self._kernel_past)
+        else:
+            Phi_u_now   = self._Phi_u_now
+            kernel_past = self._kernel_past
+
+        self._partitions = []
+        for x_indices, u_indices in self.__makePartitions():
+            past_rows = np.concatenate([u_indices, Nu + x_indices])
+            now,  now_columns  = self.__localize(Phi_u_now[u_indices])
+            past, past_columns = self.__localize(kernel_past[past_rows])
+            self._partitions.append((x_indices, u_indices, now, now_columns, past_rows, past, past_columns))
+
+    def __evaluate (self, function):
+        if (self._executor is None) and (self._workers is not None) and (self._workers > 1):
+            # (re)started after close()
+            self._executor = ThreadPoolExecutor(max_workers=self._workers)
+        if self._executor is None:
+            for partition in self._partitions:
+                function(partition)
+        else:
+            # list() waits for all partitions and raises their exceptions
+            list(self._executor.map(function, self._partitions))
+
+    def _updatePast(self):
+        window = self._delta.window()
+        past = np.empty([self._Nu+self._Nx, window.shape[1]], dtype=window.dtype)
+
+        def update (partition):
+            past_rows, kernel, columns = partition[4:]
+            past[past_rows] = kernel.dot(window[columns])
+
+        self.__evaluate(update)
+        self._u_past = past[:self._Nu]
+        self._hat_x  = past[self._Nu:]
+
+    def __control (self, delta):
+        u = np.empty([self._Nu, delta.shape[1]], dtype=delta.dtype)
+
+        def control (partition):
+            u_indices, kernel, columns = partition[1:4]
+            u[u_indices] = kernel.dot(delta[columns]) + self._u_past[u_indices]
+
+        self.__evaluate(control)
         return u
 
+    def controlConvergence(self, y):
+        return self.__control(y - self._hat_x)
+
     def getControl(self, y):
-        self._FIFO_insert(self._delta, y - self._hat_x, self._FIR_horizon+1)
-        u           = self._convolve(A=self._Phi_u, B=self._delta, lb=1, ub=self._FIR_horizon+1, offset=1)
-        self._hat_x = self._convolve(A=self._Phi_x, B=self._delta, lb=2, ub=self._FIR_horizon+1, offset=2)
+        delta = y - self._hat_x
+        u = self.__control(delta)
+
+        self._delta.push(delta)
+        self._updatePast()
 
         return u
 
+    def getStateSpaceRealization(self):
+        # the partitions are executed step by step, so that the simulator does not compile them away
+        return None
+
 class SLS_OutputFeedback_FIR_Controller (SLS_FIR_Controller):
     '''
     Output feedback SLS controller with finite impulse response
@@ -112,17 +407,20 @@ class SLS_OutputFeedback_FIR_Controller (SLS_FIR_Controller):
         self._Phi_uy = []  # = [ Phi_uy[0], Phi_uy[1], Phi_uy[2], ... Phi_uy[FIR_horizon] ]
 
     def initialize (self):
-        self._beta = []
-        self._bar_y = []
         self.precalculation()
+        self._beta  = FIR_Buffer(self._FIR_horizon, self._Nx, dtype=self._dtype)
+        self._bar_y = FIR_Buffer(self._FIR_horizon, self._Ny, dtype=self._dtype)
+        self.__updatePast()
 
-    def controlConvergence(self, y):
-        u_prime = (
-            self._convolve(A=self._tilde_Phi_ux, B=self._beta,  lb=0, ub=self._FIR_horizon,   offset=0) +
-            self._convolve(A=self._Phi_uy,       B=self._bar_y, lb=1, ub=self._FIR_horizon+1, offset=1)
+    def __updatePast(self):
+        # the contribution of the past beta and bar_y to u
+        self._u_past = (
+            self._kernel_u_beta.dot(self._beta.window()) +
+            self._kernel_u_bar_y.dot(self._bar_y.window())
         )
-        u = np.dot(self._u_multiplier, u_prime + np.dot(self._Phi_uy[0], y))
-        return u
+
+    def controlConvergence(self, y):
+        return self._u_now.dot(y) + self._u_past
 
     def getControl(self, y):
         '''
@@ -143,18 +441,16 @@ class SLS_OutputFeedback_FIR_Controller (SLS_FIR_Controller):
         #   u[t] = u' + Phi_uy[0] (y[t] - D22 u[t])
         #        = (I + Phi_uy[0] D22)^{-1} (u' + Phi_uy[0] y[t])
         #        = u_multiplier * (u' + Phi_uy[0] y[t])
+        # u_multiplier is folded into u_now and the kernels of u'
+        u = self._u_now.dot(y) + self._u_past
 
-        u_prime = (
-            self._convolve(A=self._tilde_Phi_ux, B=self._beta,  lb=0, ub=self._FIR_horizon,   offset=0) +
-            self._convolve(A=self._Phi_uy,       B=self._bar_y, lb=1, ub=self._FIR_horizon+1, offset=1)
-        )
-        u = np.dot(self._u_multiplier, u_prime + np.dot(self._Phi_uy[0], y))
+        self._bar_y.push(y - self._kernel_D22.dot(u))
 
-        self._FIFO_insert(self._bar_y, y - np.dot(self._D22,u), self._FIR_horizon+1)
+        z_beta = (self._kernel_beta_beta.dot(self._beta.window()) +
+                  self._kernel_beta_bar_y.dot(self._bar_y.window()))
+        self._beta.push(z_beta)
 
-        z_beta = (self._convolve(A=self._tilde_Phi_xx, B=self._beta,  lb=0, ub=self._FIR_horizon, offset=0) +
-                  self._convolve(A=self._tilde_Phi_xy, B=self._bar_y, lb=0, ub=self._FIR_horizon, offset=0))
-        self._FIFO_insert(self._beta, z_beta, self._FIR_horizon)
+        self.__updatePast()
 
         return u
     
@@ -171,4 +467,79 @@ class SLS_OutputFeedback_FIR_Controller (SLS_FIR_Controller):
             if i > 0:
                 self._tilde_Phi_xx.append(-self._Phi_xx[i+1])
         
-        self._u_multiplier = np.linalg.pinv( np.eye(self._D22.shape[1]) + np.dot(self._Phi_uy[0], self._D22) )
\ No newline at end of file
+        # D22 can be scipy.sparse
+        self._u_multiplier = np.linalg.pinv( np.eye(self._D22.shape[1]) + np.asarray(self._Phi_uy[0] @ self._D22) )
+
+        # stack the taps acting on [ beta[0]; beta[1]; ... ] and [ bar_y[0]; bar_y[1]; ... ]
+        H  = self._FIR_horizon
+        Nx = self._Nx
+        Ny = self._Ny
+        Nu = self._Nu
+        self._use_sparse = self._detectSupport(self._Phi_xx, self._Phi_ux, self._Phi_xy, self._Phi_uy)
+        if self._use_sparse:
+            u_multiplier = sp.csr_matrix(self._u_multiplier)
+        else:
+            u_multiplier = self._u_multiplier
+        self._u_now             = self._asDtype(u_multiplier @ self._kernelTaps(self._Phi_uy, 0, 1, (Nu,Ny)))
+        self._kernel_u_beta     = self._asDtype(u_multiplier @ self._kernelTaps(self._tilde_Phi_ux, 0, H,   (Nu,Nx)))
+        self._kernel_u_bar_y    = self._asDtype(u_multiplier @ self._kernelTaps(self._Phi_uy,       1, H+1, (Nu,Ny)))
+        self._kernel_beta_beta  = self._asDtype(self._kernelTaps(self._tilde_Phi_xx, 0, H, (Nx,Nx)))
+        self._kernel_beta_bar_y = self._asDtype(self._kernelTaps(self._tilde_Phi_xy, 0, H, (Nx,Ny)))
+        self._kernel_D22        = self._asDtype(self._D22)
+
+    def getFeedthrough(self):
+        # u[t] = u_multiplier Phi_uy[0] y[t] + ...
+        return np.dot(self._u_multiplier, self._Phi_uy[0])
+
+    def getStateSpaceRealization(self):
+        '''
+        xi = [ beta[0]; ... beta[FIR_horizon-1]; bar_y[0]; ... bar_y[FIR_horizon-1] ]
+        u[t]       = u_multiplier (tilde_Phi_ux beta + Phi_uy[1:] bar_y + Phi_uy[0] y[t])
+        bar_y_new  = y[t] - D22 u[t]
+        z beta     = tilde_Phi_xx beta + tilde_Phi_xy[0] bar_y_new + tilde_Phi_xy[1:] bar_y
+        '''
+        H  = self._FIR_horizon
+        Nx = self._Nx
+        Ny = self._Ny
+        Nu = self._Nu
+
+        C_beta  = self._concatenate_taps(self._tilde_Phi_ux, 0, H,   (Nu,Nx))
+        C_bar_y = self._concatenate_taps(self._Phi_uy,       1, H+1, (Nu,Ny))
+        Ck = np.dot(self._u_multiplier, np.hstack([C_beta, C_bar_y]))
+        Dk = np.dot(self._u_multiplier, self._Phi_uy[0])
+
+        # bar_y_new = R_xi xi + R_y y
+        R_xi = -np.asarray(self._D22 @ Ck)
+        R_y  = np.eye(Ny) - np.asarray(self._D22 @ Dk)
+
+        tilde_Phi_xy_0 = self._concatenate_taps(self._tilde_Phi_xy, 0, 1, (Nx,Ny))
+        beta_new_xi = np.hstack([
+            self._concatenate_taps(self._tilde_Phi_xx, 0, H, (Nx,Nx)),
+            self._concatenate_taps(self._tilde_Phi_xy, 1, H+1, (Nx,Ny))
+        ]) + np.dot(tilde_Phi_xy_0, R_xi)
+        beta_new_y  = np.dot(tilde_Phi_xy_0, R_y)
+
+        # beta_new and bar_y_new enter their shift registers
+        shift = sp.block_diag((self._shift_matrix(H,Nx), self._shift_matrix(H,Ny)), format='csr')
+        Ak = sp.vstack([beta_new_xi, shift[Nx:H*Nx], R_xi, shift[H*Nx+Ny:]], format='csr')
+        Bk = sp.vstack([
+            beta_new_y, sp.csr_matrix(((H-1)*Nx,Ny)),
+            R_y,        sp.csr_matrix(((H-1)*Ny,Ny))
+        ], format='csr')
+
+        return Ak, Bk, Ck, Dk
+
+    def getRealizationState(self):
+        beta  = self._beta.window()
+        bar_y = self._bar_y.window()
+        if beta.shape[1] != bar_y.shape[1]:
+            columns = max(beta.shape[1], bar_y.shape[1])
+            beta  = np.repeat(beta,  columns // beta.shape[1],  axis=1)
+            bar_y = np.repeat(bar_y, columns // bar_y.shape[1], axis=1)
+        return np.vstack([beta, bar_y])
+
+    def setRealizationState(self, xi):
+        H = self._FIR_horizon
+        self._beta.setWindow(xi[:H*self._Nx])
+        self._bar_y.setWindow(xi[H*self._Nx:])
+        self.__updatePast()
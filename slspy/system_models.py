@@ -1,5 +1,7 @@
 from .core import SystemModel, error_message
+from .convolution import FIR_Buffer, fir_convolve
 import numpy as np
+import scipy.sparse as sp
 '''
 To create a new system model, inherit the following base function and customize the specified methods.
 
@@ -48,6 +50,17 @@ class LTI_System (SystemModel):
         self._D21 = None # np.zeros([Ny,Nw])
         self._D22 = None # np.zeros([Ny,Nu])
 
+        # set by sanityCheck(), c.f. isSparse()
+        self._sparse = False
+        # the validated model, c.f. sanityCheck()
+        self._validated = None
+        # the matrices cast to the dtype at initialize(), None uses the matrices as they are, c.f. _castMatrices()
+        self._cast_matrices = None
+
+        # c.f. setWorkBuffers()
+        self._work_buffers = False
+        self._xwu = None
+
         # vector dimensions of
         self._Nx = Nx  # state
         self._Nw = Nw  # noise
@@ -55,7 +68,8 @@ class LTI_System (SystemModel):
         self._Nz = Nz  # output
         self._Ny = Ny  # measurement
 
-    def initialize (self, x0=None):
+    def initialize (self, x0=None, trajectories=1):
+        # trajectories > 1 stacks that many trajectories side by side as the columns of x
         SystemModel.initialize(self)
 
         if x0 is None:
@@ -68,9 +82,16 @@ class LTI_System (SystemModel):
         else:
             self._x0 = x0
 
+        # the steps use cast copies of the matrices if a dtype is set, c.f. setDtype()
+        self._cast_matrices = self._castMatrices() if self._dtype is not None else None
+        A, B1, B2, C1, D11, D12, C2, D21, D22 = self._matrixValues()
+
         # set x0
         self._Nx = x0.shape[0]
-        self._x  = x0
+        self._x  = self._asDtype(x0)
+        if (trajectories != 1) and (x0.shape[1] == 1):
+            # all trajectories start from the same initial state
+            self._x = np.repeat(self._x, trajectories, axis=1)
 
         # initializing output and measurements by treating w and u to be zeros.
         # one might change this part for some other initialization strategies
@@ -78,16 +99,90 @@ class LTI_System (SystemModel):
             if self._C1 is None:
                 self.errorMessage('C1 is not defined when the system output (z) is not ignored. Initialization fails.')
             else:
-                self._z = np.dot (self._C1, self._x)
+                self._z = C1.dot(self._x)
 
         if not self._state_feedback:
             if self._C2 is None:
                 self.errorMessage('C2 is not defined for an output-feedback system. Initialization fails.')
             else:
-                self._y = np.dot (self._C2, self._x)
+                self._y = C2.dot(self._x)
+
+        # the work buffers are (re)built at the next step, c.f. setWorkBuffers()
+        self._xwu = None
+
+    def _castMatrices (self):
+        # A, B1, B2, C1, D11, D12, C2, D21, D22 in the dtype of the system, the assigned matrices are left unchanged
+        return tuple(self._asDtype(getattr(self, name)) for name in self._matrices)
+
+    def _matrixValues (self):
+        # the matrices used by the steps, c.f. initialize()
+        if self._cast_matrices is None:
+            return tuple(getattr(self, name) for name in self._matrices)
+        return self._cast_matrices
+
+    def setWorkBuffers (self, work_buffers=True):
+        # True: keep the stacked matrices [A B1 B2], [C1 D11 D12], [C2 D21 D22] and update
+        #       x, z, y in place by one product each into preallocated (double) buffers
+        # the buffers hold the values of two consecutive steps, i.e.,
+        # the arrays returned by getState(copy=False) are overwritten two steps later
+        # the matrices are stacked at the first step after initialize()
+        self._work_buffers = work_buffers
+        self._xwu = None
+
+    def __prepareWorkBuffers (self):
+        # the matrices are assumed to pass sanityCheck()
+        stack = (lambda blocks: sp.hstack(blocks, format='csr')) if self._sparse else np.hstack
+        A, B1, B2, C1, D11, D12, C2, D21, D22 = self._matrixValues()
+        self._M_x = stack([A, B1, B2])
+        self._M_z = None if self._ignore_output  else stack([C1, D11, D12])
+        self._M_y = None if self._state_feedback else stack([C2, D21, D22])
+
+        # the current state lives in the first Nx rows of the stacked [ x; w; u ]
+        dtype = np.result_type(self._M_x.dtype, self._x.dtype)
+        K = self._x.shape[1]
+        self._xwu = [np.zeros([self._M_x.shape[1], K], dtype=dtype) for i in range(2)]
+        self._zs  = [np.zeros([self._Nz, K], dtype=dtype) for i in range(2)] if self._M_z is not None else None
+        self._ys  = [np.zeros([self._Ny, K], dtype=dtype) for i in range(2)] if self._M_y is not None else None
+        self._x_views = [xwu[:self._Nx] for xwu in self._xwu]
+        self._buffer = 0
+        self._x_views[0][:] = self._x
+        self._x = self._x_views[0]
+
+    def __stackInputs (self, u, w):
+        # write w and u below the current state, return the stacked [ x; w; u ]
+        if self._xwu is None:
+            self.__prepareWorkBuffers()
+        elif self._x is not self._x_views[self._buffer]:
+            # x was assigned from outside, e.g., by a compiled closed loop
+            if self._x.shape != self._x_views[self._buffer].shape:
+                self.__prepareWorkBuffers()
+            else:
+                self._x_views[self._buffer][:] = self._x
+                self._x = self._x_views[self._buffer]
+        xwu = self._xwu[self._buffer]
+        Nxw = self._Nx + self._Nw
+        if w is None:
+            xwu[self._Nx:Nxw] = 0
+        else:
+            xwu[self._Nx:Nxw] = w
+        xwu[Nxw:] = u
+        return xwu
+
+    @staticmethod
+    def __product (M, v, out):
+        if sp.issparse(M):
+            out[:] = M.dot(v)
+        else:
+            np.dot(M, v, out=out)
+        return out
 
     def sanityCheck (self):
         # check the system parameters are coherent
+        # the check is skipped if no matrix has been (re)assigned since the last successful check
+        # in-place modifications cannot change the shapes, so they need no re-check
+        if self.__isValidated():
+            return True
+
         if self._Nx == 0:
             return self.errorMessage('Zero dimension (missing initialization): x')
 
@@ -95,21 +190,29 @@ class LTI_System (SystemModel):
         Nw = self._Nw
         Nu = self._Nu = self._B2.shape[1]
 
+        # a system with any scipy.sparse matrix is sparse: its matrices are kept in CSR,
+        # and the undefined ones are implicit (empty sparse) zero blocks
+        self._sparse = any(sp.issparse(getattr(self, name)) for name in self._matrices)
+        for name in self._matrices:
+            matrix = getattr(self, name)
+            if sp.issparse(matrix) and (matrix.format != 'csr'):
+                setattr(self, name, matrix.tocsr())
+
         # fill in zero matrices if undefined
         if self._A is None:
-            self._A = np.zeros([Nx,Nx])
+            self._A = self.__zeros(Nx,Nx)
         elif ((self._A.shape[0] != Nx) or
             (self._A.shape[1] != Nx)):
             return self.errorMessage('Dimension mismatch: A')
         
         if self._B1 is None:
-            self._B1 = np.zeros([Nx,Nw])
+            self._B1 = self.__zeros(Nx,Nw)
         elif ((self._B1.shape[0] != Nx) or
             (self._B1.shape[1] != Nw)):
             return self.errorMessage('Dimension mismatch: B1')
 
         if self._B2 is None:
-            self._B2 = np.zeros([Nx,Nu])
+            self._B2 = self.__zeros(Nx,Nu)
         elif self._B2.shape[0] != Nx:
             return self.errorMessage('Dimension mismatch: B2')
 
@@ -124,18 +227,18 @@ class LTI_System (SystemModel):
                 return self.errorMessage('None of C1, D11, D12 is set while the output is not ignorable.')
 
             if self._C1 is None:
-                self._C1 = np.zeros([Nz,Nx])
+                self._C1 = self.__zeros(Nz,Nx)
             elif self._C1.shape[1] != Nx:  # remark: no need to check self._C1.shape[0] == Nz
                 return self.errorMessage('Dimension mismatch: C1')
 
             if self._D11 is None:
-                self._D11 = np.zeros([Nz,Nw])
+                self._D11 = self.__zeros(Nz,Nw)
             elif ((self._D11.shape[0] != Nz) or
                   (self._D11.shape[1] != Nw)):
                 return self.errorMessage('Dimension mismatch: D11')
 
             if self._D12 is None:
-                self._D12 = np.zeros([Nz,Nu])
+                self._D12 = self.__zeros(Nz,Nu)
             elif ((self._D12.shape[0] != Nz) or
                   (self._D12.shape[1] != Nu)):
                 return self.errorMessage('Dimension mismatch: D12')
@@ -149,25 +252,59 @@ class LTI_System (SystemModel):
             )
 
             if self._C2 is None:
-                self._C2 = np.zeros([Ny,Nx])
+                self._C2 = self.__zeros(Ny,Nx)
             elif self._C2.shape[1] != Nx:  # remark: no need to check self._C2.shape[0] == Ny
                 return self.errorMessage('Dimension mismatch: C2')
 
             if self._D21 is None:
-                self._D21 = np.zeros([Ny,Nw])
+                self._D21 = self.__zeros(Ny,Nw)
             elif ((self._D21.shape[0] != Ny) or
                   (self._D21.shape[1] != Nw)):
                 return self.errorMessage('Dimension mismatch: D21')
 
             if self._D22 is None:
-                self._D22 = np.zeros([Ny,Nu])
+                self._D22 = self.__zeros(Ny,Nu)
             elif ((self._D22.shape[0] != Ny) or
                   (self._D22.shape[1] != Nu)):
                 return self.errorMessage('Dimension mismatch: D22')
 
+        self._validated = self.__modelSignature()
         return True
 
+    _matrices = ('_A', '_B1', '_B2', '_C1', '_D11', '_D12', '_C2', '_D21', '_D22')
+
+    def __modelSignature (self):
+        # the matrices are compared by identity, which keeps them referenced
+        return (
+            (self._Nx, self._Nw, self._ignore_output, self._state_feedback),
+            tuple(getattr(self, name) for name in self._matrices)
+        )
+
+    def __isValidated (self):
+        if self._validated is None:
+            return False
+        settings, matrices = self.__modelSignature()
+        return (
+            settings == self._validated[0] and
+            all(a is b for a, b in zip(matrices, self._validated[1]))
+        )
+
+    def __zeros (self, rows, columns):
+        if self._sparse:
+            return sp.csr_matrix((rows, columns))
+        return np.zeros([rows, columns])
+
+    def isSparse (self):
+        return self._sparse
+
     def measurementConverge(self, u, w=None):
+        if self._work_buffers:
+            if self._state_feedback:
+                return None
+            xwu = self.__stackInputs(u, w)
+            return self._M_y.dot(xwu)
+
+        A, B1, B2, C1, D11, D12, C2, D21, D22 = self._matrixValues()
         if w is not None:
             if w.shape[0] != self._Nw:
                 return self.errorMessage('Dimension mismatch: w')
@@ -178,15 +315,15 @@ class LTI_System (SystemModel):
 
             if not self._state_feedback:
                 y = (
-                    np.dot (self._C2, self._x) +
-                    np.dot (self._D21, w) + 
-                    np.dot (self._D22, u)
+                    C2.dot(self._x) +
+                    D21.dot(w) + 
+                    D22.dot(u)
                 )
         else:
             if not self._state_feedback:
                 y = (
-                    np.dot (self._C2, self._x) +
-                    np.dot (self._D22, u)
+                    C2.dot(self._x) +
+                    D22.dot(u)
                 )
 
         return y
@@ -198,6 +335,21 @@ class LTI_System (SystemModel):
         if u.shape[0] != self._Nu:
             return self.errorMessage('Dimension mismatch: u')
 
+        if self._work_buffers:
+            # in place: one product per signal into the other buffer
+            if (w is not None) and (len(w) != self._Nw):
+                return self.errorMessage('Dimension mismatch: w')
+            xwu = self.__stackInputs(u, w)
+            current = self._buffer
+            self._buffer = 1 - current
+            if self._M_y is not None:
+                self._y = self.__product(self._M_y, xwu, self._ys[current])
+            if self._M_z is not None:
+                self._z = self.__product(self._M_z, xwu, self._zs[current])
+            self._x = self.__product(self._M_x, xwu, self._x_views[self._buffer])
+            return
+
+        A, B1, B2, C1, D11, D12, C2, D21, D22 = self._matrixValues()
         if w is not None:
             if w.shape[0] != self._Nw:
                 return self.errorMessage('Dimension mismatch: w')
@@ -208,42 +360,68 @@ class LTI_System (SystemModel):
 
             if not self._state_feedback:
                 self._y = (
-                    np.dot (self._C2, self._x) +
-                    np.dot (self._D21, w) + 
-                    np.dot (self._D22, u)
+                    C2.dot(self._x) +
+                    D21.dot(w) + 
+                    D22.dot(u)
                 )
             
             if not self._ignore_output:
                 self._z = (
-                    np.dot (self._C1, self._x) +
-                    np.dot (self._D11, w) + 
-                    np.dot (self._D12, u)
+                    C1.dot(self._x) +
+                    D11.dot(w) + 
+                    D12.dot(u)
                 )
 
             self._x = (
-                np.dot (self._A, self._x) +
-                np.dot (self._B1, w) + 
-                np.dot (self._B2, u)
+                A.dot(self._x) +
+                B1.dot(w) + 
+                B2.dot(u)
             )
         else:
             # noise free
             if not self._state_feedback:
                 self._y = (
-                    np.dot (self._C2, self._x) +
-                    np.dot (self._D22, u)
+                    C2.dot(self._x) +
+                    D22.dot(u)
                 )
 
             if not self._ignore_output:
                 self._z = (
-                    np.dot (self._C1, self._x) +
-                    np.dot (self._D12, u)
+                    C1.dot(self._x) +
+                    D12.dot(u)
                 )
 
             self._x = (
-                np.dot (self._A, self._x) +
-                np.dot (self._B2, u)
+                A.dot(self._x) +
+                B2.dot(u)
             )
 
+    def getFeedthrough (self):
+        if self._state_feedback:
+            return self.__zeros(self._Nx,self._Nu)
+        return self._D22
+
+    def getStateSpaceRealization (self):
+        # the matrices are assumed to pass sanityCheck()
+        if self._ignore_output:
+            C1 = D11 = D12 = None
+        else:
+            C1  = self._C1
+            D11 = self._D11
+            D12 = self._D12
+
+        if self._state_feedback:
+            # y = x
+            C2  = sp.eye(self._Nx, format='csr') if self._sparse else np.eye(self._Nx)
+            D21 = self.__zeros(self._Nx,self._Nw)
+            D22 = self.__zeros(self._Nx,self._Nu)
+        else:
+            C2  = self._C2
+            D21 = self._D21
+            D22 = self._D22
+
+        return self._A, self._B1, self._B2, C1, D11, D12, C2, D21, D22
+
     def updateActuation (self,new_act_ids=None):
         '''
         make a new system with the dynamics of the old system and updated
@@ -278,14 +456,179 @@ class LTI_System (SystemModel):
         sys._Ny = self._Ny
         sys._Nw = self._Nw
 
+        sys._work_buffers = self._work_buffers
+
+        return sys
+
+
+class LTI_Ensemble_System (LTI_System):
+    '''
+    An ensemble of LTI systems of the same dimensions, e.g., perturbations of a nominal plant.
+    Each matrix is either a stack of shape (members, rows, columns), one matrix per member,
+    or a matrix (numpy or scipy.sparse) shared by all members.
+    Member k is the k-th trajectory (column) of the signals, and all members advance together by batched products,
+    so one controller is simulated against the whole ensemble by
+        Simulator(system=ensemble, controller=controller, trajectories=ensemble.getMembers())
+    '''
+    def getMembers (self):
+        # the number of members, 1 if no matrix is stacked
+        for name in self._matrices:
+            matrix = getattr(self, name)
+            if isinstance(matrix, np.ndarray) and matrix.ndim == 3:
+                return matrix.shape[0]
+        return 1
+
+    def getRequiredTrajectories (self):
+        return self.getMembers()
+
+    def getMember (self, index=0):
+        # the LTI_System of one member
+        sys = LTI_System(Nx=self._Nx, Nw=self._Nw, Nu=self._Nu, Ny=self._Ny, Nz=self._Nz,
+            ignore_output=self._ignore_output, state_feedback=self._state_feedback)
+        for name in self._matrices:
+            matrix = getattr(self, name)
+            if isinstance(matrix, np.ndarray) and matrix.ndim == 3:
+                matrix = matrix[index]
+            setattr(sys, name, matrix)
+        sys._x0 = self._x0
         return sys
 
+    @staticmethod
+    def _apply (matrix, v):
+        # the k-th column of v is multiplied by the k-th matrix of a stack, or all columns by a shared matrix
+        # v can be a (N,1) signal shared by all members
+        if isinstance(matrix, np.ndarray) and matrix.ndim == 3:
+            return np.matmul(matrix, v.T[:,:,np.newaxis])[:,:,0].T
+        return matrix.dot(v)
+
+    def initialize (self, x0=None, trajectories=None):
+        # trajectories must be the number of members, None sets it
+        SystemModel.initialize(self)
+
+        if not self.normalize():
+            return
+        members = self.getMembers()
+        if trajectories is None:
+            trajectories = members
+        elif trajectories != members:
+            self.errorMessage('The ensemble has %d members, simulate as many trajectories.' % members)
+            return
+
+        if x0 is None:
+            if (self._x0 is None) and (self._Nx > 0):
+                self._x0 = np.zeros([self._Nx,1])
+            x0 = self._x0
+        else:
+            self._x0 = x0
+
+        # the steps use cast copies of the matrices if a dtype is set, c.f. LTI_System.initialize()
+        self._cast_matrices = self._castMatrices() if self._dtype is not None else None
+        A, B1, B2, C1, D11, D12, C2, D21, D22 = self._matrixValues()
+
+        # x0 is (Nx,1) for all members or (Nx,members)
+        self._Nx = x0.shape[0]
+        self._x  = self._asDtype(x0)
+        if x0.shape[1] == 1:
+            self._x = np.repeat(self._x, trajectories, axis=1)
+
+        if not self._ignore_output:
+            if self._C1 is None:
+                self.errorMessage('C1 is not defined when the system output (z) is not ignored. Initialization fails.')
+            else:
+                self._z = self._apply(C1, self._x)
+
+        if not self._state_feedback:
+            if self._C2 is None:
+                self.errorMessage('C2 is not defined for an output-feedback system. Initialization fails.')
+            else:
+                self._y = self._apply(C2, self._x)
+
+    def setWorkBuffers (self, work_buffers=True):
+        # the batched products of the stacks need no work buffers
+        if work_buffers:
+            self.warningMessage('Work buffers are not supported by ensembles.')
+        self._work_buffers = False
+
+    def sanityCheck (self):
+        # the stacks must agree on the number of members, and each member must pass LTI_System.sanityCheck()
+        # the ensemble itself is left unchanged, c.f. normalize()
+        members = self.getMembers()
+        for name in self._matrices:
+            matrix = getattr(self, name)
+            if isinstance(matrix, np.ndarray) and (matrix.ndim == 3) and (matrix.shape[0] != members):
+                return self.errorMessage('Number of members mismatch: %s' % name[1:])
+
+        return self.getMember(0).sanityCheck()
+
+    def normalize (self):
+        # fill in the undefined matrices by the shared zero matrices of the members and set Nu, Nz, Ny,
+        # as LTI_System.sanityCheck() does for a single system, called by initialize()
+        if not self.sanityCheck():
+            return False
+        member = self.getMember(0)
+        member.sanityCheck()
+        for name in self._matrices:
+            if getattr(self, name) is None:
+                setattr(self, name, getattr(member, name))
+        self._Nu, self._Nz, self._Ny = member._Nu, member._Nz, member._Ny
+        self._sparse = member._sparse
+        return True
+
+    def measurementConverge(self, u, w=None):
+        if self._state_feedback:
+            return None
+        A, B1, B2, C1, D11, D12, C2, D21, D22 = self._matrixValues()
+        y = self._apply(C2, self._x) + self._apply(D22, u)
+        if w is not None:
+            y = y + self._apply(D21, np.asarray(w))
+        return y
+
+    def systemProgress (self, u, w=None):
+        if u.shape[0] != self._Nu:
+            return self.errorMessage('Dimension mismatch: u')
+        if w is not None:
+            if w.shape[0] != self._Nw:
+                return self.errorMessage('Dimension mismatch: w')
+            w = np.asarray(w)
+
+        A, B1, B2, C1, D11, D12, C2, D21, D22 = self._matrixValues()
+        if not self._state_feedback:
+            self._y = self._apply(C2, self._x) + self._apply(D22, u)
+            if w is not None:
+                self._y += self._apply(D21, w)
+
+        if not self._ignore_output:
+            self._z = self._apply(C1, self._x) + self._apply(D12, u)
+            if w is not None:
+                self._z += self._apply(D11, w)
+
+        x = self._apply(A, self._x) + self._apply(B2, u)
+        if w is not None:
+            x += self._apply(B1, w)
+        self._x = x
+
+    def getFeedthrough (self):
+        # the convergence phase is solved directly only if the members share D22
+        if self._state_feedback:
+            return LTI_System.getFeedthrough(self)
+        if isinstance(self._D22, np.ndarray) and self._D22.ndim == 3:
+            return None
+        return self._D22
+
+    def getStateSpaceRealization (self):
+        # the members have different realizations
+        return None
+
 
 class LTI_FIR_System (SystemModel):
     '''
     The LTI FIR system with
         y = G    u + P_yw w
         z = P_zu u + P_zw w
+    The transfer matrices are stacked into one kernel
+        K[tau] = [ G[tau]   P_yw[tau] ]
+                 [ P_zu[tau] P_zw[tau] ]
+    of shape (FIR length, Ny+Nz, Nu+Nw), and the past inputs [ u; w ] are kept in a FIR_Buffer
     '''
     def __init__ (self, Nw=0, Nu=0, Ny=0, Nz=0, **kwargs):
         SystemModel.__init__(self, **kwargs)
@@ -300,49 +643,118 @@ class LTI_FIR_System (SystemModel):
         self._Pzu = []
         self._Pzw = []
 
-        self._u = []
-        self._w = []
+        self._kernel = None
 
         self._state_feedback = False
 
-        self._zero_y = np.zeros([Ny,1])
-        self._zero_z = np.zeros([Nz,1])
+        self._x = self._y = np.zeros([Ny,1])
+        self._z = np.zeros([Nz,1])
 
-        self._x = self._y = self._zero_y.copy()
-        self._z = self._zero_z.copy()
+    def initialize (self, trajectories=1):
+        # clear the input history
+        # trajectories > 1 stacks that many trajectories side by side as the columns of y
+        SystemModel.initialize(self)
 
-    @staticmethod
-    def _convolve(G,u):
-        # perform sum_{t = 0}^{infty} G[t]u[t]
-        Gu = 0
-        convolution_len = min(len(G),len(u))
-        for tau in range(convolution_len):
-            Gu += np.dot(G[tau],u[tau])
-        return Gu
+        self.precalculation()
 
-    def measurementConverge(self, u, w=None):
-        u_convergence = [u] + self._u
-        w_convergence = [w] + self._w
-        y = self._convolve(self._G, u_convergence) + self._convolve(self._Pyw, w_convergence)
+        # the past inputs [ u; w ], newest first
+        dtype = self._kernel.dtype
+        self._history = FIR_Buffer(self._kernel.shape[0] - 1, self._Nu+self._Nw, dtype=dtype)
+        self._inputs = np.zeros([self._Nu+self._Nw, trajectories], dtype=dtype)
 
-        if y is 0:
-            y = self._zero_y.copy()
+        # the contribution of the past inputs to [ y; z ]
+        self._past = np.zeros([self._Ny+self._Nz, trajectories], dtype=dtype)
 
-        return y
+        self._x = self._y = np.zeros([self._Ny,trajectories], dtype=dtype)
+        self._z = np.zeros([self._Nz,trajectories], dtype=dtype)
+
+    def precalculation (self):
+        # stack G, P_yw, P_zu, P_zw into the kernel
+        Ny = self._Ny
+        Nz = self._Nz
+        Nu = self._Nu
+        Nw = self._Nw
+
+        FIR_len = max(len(self._G), len(self._Pyw), len(self._Pzu), len(self._Pzw), 1)
+        kernel = np.zeros([FIR_len, Ny+Nz, Nu+Nw])
+        for tau in range(len(self._G)):
+            kernel[tau, :Ny, :Nu] = self._G[tau]
+        for tau in range(len(self._Pyw)):
+            kernel[tau, :Ny, Nu:] = self._Pyw[tau]
+        for tau in range(len(self._Pzu)):
+            kernel[tau, Ny:, :Nu] = self._Pzu[tau]
+        for tau in range(len(self._Pzw)):
+            kernel[tau, Ny:, Nu:] = self._Pzw[tau]
+
+        self._kernel = kernel = self._asDtype(kernel)
+        # K[0] acts on the current input, [ K[1] K[2] ... ] on the history
+        self._kernel_now  = kernel[0]
+        self._kernel_past = kernel[1:].transpose(1,0,2).reshape(Ny+Nz, (FIR_len-1)*(Nu+Nw))
+
+    def getFeedthrough (self):
+        # y(t) = G[0] u(t) + ...
+        if len(self._G) == 0:
+            return np.zeros([self._Ny,self._Nu])
+        return self._G[0]
+
+    def _respond (self, u, w, rows):
+        # rows of [ y; z ] given the current input
+        response = self._past[rows] + np.dot(self._kernel_now[rows, :self._Nu], u)
+        if w is not None:
+            response = response + np.dot(self._kernel_now[rows, self._Nu:], w)
+        return response
+
+    def measurementConverge(self, u, w=None):
+        if self._kernel is None:
+            self.initialize()
+        return self._respond(u, w, slice(0, self._Ny))
 
     def systemProgress (self, u, w=None, **kwargs):
-        self._u = [u] + self._u
-        self._w = [w] + self._w
+        if self._kernel is None:
+            self.initialize()
+
+        response = self._respond(u, w, slice(None))
+        self._x = self._y = response[:self._Ny]
+        self._z = response[self._Ny:]
+
+        if self._kernel.shape[0] == 1:
+            return
+
+        # push [ u; w ] into the history, (N,1) signals are broadcast to all trajectories
+        self._inputs[:self._Nu] = u
+        if w is None:
+            self._inputs[self._Nu:] = 0
+        else:
+            self._inputs[self._Nu:] = w
+        self._history.push(self._inputs)
+        self._past = np.dot(self._kernel_past, self._history.window())
+
+    def computeResponse (self, u=None, w=None, method='auto'):
+        # the outputs to whole input sequences known up front, starting from rest, without changing the system state
+        # u, w: (horizon, Nu) and (horizon, Nw) arrays, or with a trailing trajectories axis, None means zero
+        # return y, z with the matching shapes
+        # long truncations are convolved by FFT, c.f. fir_convolve()
+        if self._kernel is None:
+            self.precalculation()
+
+        if (u is None) and (w is None):
+            return None, None
+        reference = u if u is not None else w
+        shape = (reference.shape[0], self._Nu+self._Nw) + reference.shape[2:]
+        inputs = np.zeros(shape, dtype=self._kernel.dtype)
+        if u is not None:
+            inputs[:, :self._Nu] = u
+        if w is not None:
+            inputs[:, self._Nu:] = w
 
-        while (len(self._u) > len(self._G)) and (len(self._u) > len(self._Pzu)):
-            self._u.pop(-1)
-        while (len(self._w) > len(self._Pyw)) and (len(self._w) > len(self._Pzw)):
-            self._w.pop(-1)
+        response = fir_convolve(self._kernel, inputs, method=method)
+        return response[:, :self._Ny], response[:, self._Ny:]
 
-        self._x = self._y = self._convolve(self._G, self._u) + self._convolve(self._Pyw, self._w)
-        self._z = self._convolve(self._Pzu, self._u) + self._convolve(self._Pzw, self._w)
-        if self._z is 0:
-            self._z = self._zero_z.copy()
+def _dense (matrix):
+    # the FIR taps are dense, even if the system matrices are sparse
+    if sp.issparse(matrix):
+        return matrix.toarray()
+    return np.asarray(matrix)
 
 def truncate_LTI_System_to_LTI_FIR_System (system=None,FIR_horizon=1):
     '''
@@ -390,28 +802,28 @@ def truncate_LTI_System_to_LTI_FIR_System (system=None,FIR_horizon=1):
     tmp_y = C2
 
     truncated_system._G = [None] * FIR_horizon
-    truncated_system._G[0] = np.zeros([Ny,Ny]) if D22 is None else D22
+    truncated_system._G[0] = np.zeros([Ny,Ny]) if D22 is None else _dense(D22)
 
     truncated_system._Pyw = [None] * FIR_horizon
-    truncated_system._Pyw[0] = np.zeros([Ny,Nw]) if D21 is None else D21
+    truncated_system._Pyw[0] = np.zeros([Ny,Nw]) if D21 is None else _dense(D21)
 
     for t in range(1,FIR_horizon):
-        truncated_system._G[t]   = np.dot(tmp_y,B2)
-        truncated_system._Pyw[t] = np.dot(tmp_y,B1)
-        tmp_y = np.dot(tmp_y,A)
+        truncated_system._G[t]   = _dense(tmp_y @ B2)
+        truncated_system._Pyw[t] = _dense(tmp_y @ B1)
+        tmp_y = tmp_y @ A
 
     if not system._ignore_output:
         tmp_z = 0 if system._C1 is None else system._C1
 
         truncated_system._Pzu = [None] * FIR_horizon
-        truncated_system._Pzu[0] = np.zeros([Nz,Nu]) if system._D12 is None else system._D12 
+        truncated_system._Pzu[0] = np.zeros([Nz,Nu]) if system._D12 is None else _dense(system._D12)
 
         truncated_system._Pzw = [None] * FIR_horizon
-        truncated_system._Pzw[0] = np.zeros([Nz,Nw]) if system._D11 is None else system._D11
+        truncated_system._Pzw[0] = np.zeros([Nz,Nw]) if system._D11 is None else _dense(system._D11)
 
         for t in range(1,FIR_horizon):
-            truncated_system._Pzu[t] = np.dot(tmp_z,B2)
-            truncated_system._Pzw[t] = np.dot(tmp_z,B1)
-            tmp_z = np.dot(tmp_z,A)
+            truncated_system._Pzu[t] = _dense(tmp_z @ B2)
+            truncated_system._Pzw[t] = _dense(tmp_z @ B1)
+            tmp_z = tmp_z @ A
 
     return truncated_system
\ No newline at end of file
@@ -1,2 +1,6 @@
 from .plant_generators import *
-from .visualization_tools import *
\ No newline at end of file
+from .visualization_tools import *
+from .precision_tools import *
+from .sweep_tools import *
+from .stability_tools import *
+from .norm_tools import *
\ No newline at end of file
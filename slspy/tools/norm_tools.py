@@ -0,0 +1,122 @@
+from ..core import error_message
+from ..system_models import LTI_System, _dense
+import numpy as np
+
+'''
+Closed-loop norms of synthesized SLS controllers, computed from the Phi taps without simulating.
+
+The closed loop from w to z is the FIR filter
+    G[0]   = D11
+    G[tau] = [C1, D12][Phi_x[tau]; Phi_u[tau]] B1                                      (state feedback)
+    G[tau] = [C1, D12][Phi_xx[tau], Phi_xy[tau]; Phi_ux[tau], Phi_uy[tau]][B1; D21]  (output feedback)
+whose norms are
+    H2   : sqrt( sum_tau || G[tau] ||_F^2 )
+    HInf : max_omega sigma_max( sum_tau G[tau] e^{-j omega tau} ), evaluated on a frequency grid
+    L1   : max_i sum_tau sum_j | G[tau][i,j] |, the peak-to-peak gain
+With B1 = I and D11 = 0, e.g., the generated plants, the squared H2 norm is the value of SLS_Obj_H2.
+'''
+
+def closed_loop_response (system_model=None, controller=None):
+    '''
+    Returns the (FIR_horizon+1, Nz, Nw) taps G of the closed loop from w to z, or None
+    '''
+    if not (isinstance(system_model, LTI_System) and system_model.sanityCheck()):
+        error_message('The system must be a valid LTI_System.')
+        return None
+    if system_model._ignore_output:
+        error_message('The system output (z) is ignored.')
+        return None
+
+    C1, D11, D12, B1, D21 = [
+        _dense(matrix) for matrix in
+        (system_model._C1, system_model._D11, system_model._D12, system_model._B1, system_model._D21)
+    ]
+    if hasattr(controller, '_Phi_xx'):
+        taps = [
+            C1 @ (_dense(Phi_xx) @ B1 + _dense(Phi_xy) @ D21) + D12 @ (_dense(Phi_ux) @ B1 + _dense(Phi_uy) @ D21)
+            for Phi_xx, Phi_xy, Phi_ux, Phi_uy in zip(controller._Phi_xx, controller._Phi_xy, controller._Phi_ux, controller._Phi_uy)
+        ]
+    elif hasattr(controller, '_Phi_x'):
+        taps = [
+            (C1 @ _dense(Phi_x) + D12 @ _dense(Phi_u)) @ B1
+            for Phi_x, Phi_u in zip(controller._Phi_x, controller._Phi_u)
+        ]
+    else:
+        error_message('The controller has no Phi taps.')
+        return None
+    if len(taps) == 0:
+        error_message('The controller is not synthesized.')
+        return None
+
+    G = np.stack(taps)
+    G[0] += D11
+    return G
+
+def closed_loop_norms (system_model=None, controller=None, norms=('H2', 'HInf', 'L1'), frequencies=None):
+    '''
+    Computes the closed-loop norms of one controller, or of a list of candidate controllers of the same system
+    Inputs
+       system_model : LTI_System, the (nominal) plant of the synthesis
+       controller   : SLS_StateFeedback_FIR_Controller or SLS_OutputFeedback_FIR_Controller, or a list of them
+       norms        : the norms to compute, a subset of ('H2', 'HInf', 'L1')
+       frequencies  : the number of grid points of the HInf norm on [0, pi], at least 2,
+                      None uses max(512, 16*(FIR_horizon+1)); the grid value is a lower bound of the norm
+                      remark: the grid is never coarser than the response length, i.e., it has at least FIR_horizon/2+1 points
+    Outputs
+       a dict that maps each norm to its value, or a list of such dicts for a list of controllers
+    '''
+    if ('HInf' in norms) and (frequencies is not None) and (frequencies < 2):
+        error_message('The HInf norm needs at least 2 frequencies.')
+        return None
+
+    if isinstance(controller, (list, tuple)):
+        responses = [closed_loop_response(system_model=system_model, controller=candidate) for candidate in controller]
+        if any(G is None for G in responses):
+            return None
+        # pad the taps to a common length and evaluate the candidates as one batch
+        length = max(G.shape[0] for G in responses)
+        batch = np.zeros((len(responses), length) + responses[0].shape[1:])
+        for i, G in enumerate(responses):
+            batch[i, :G.shape[0]] = G
+        values = _norms(batch, norms, frequencies)
+        return [{name: values[name][i] for name in values} for i in range(len(responses))]
+
+    G = closed_loop_response(system_model=system_model, controller=controller)
+    if G is None:
+        return None
+    values = _norms(G[np.newaxis], norms, frequencies)
+    return {name: values[name][0] for name in values}
+
+def closed_loop_norm_metrics (synthesizer, controller, simulator=None):
+    '''
+    The closed-loop norms as the metrics of a sweep, c.f. Sweep_Spec(metrics=closed_loop_norm_metrics),
+    which scores the designs without simulating if the horizon is None
+    '''
+    return closed_loop_norms(system_model=synthesizer._system_model, controller=controller)
+
+def _norms (G, norms, frequencies):
+    # the norms of a (candidates, taps, Nz, Nw) batch of FIR responses
+    values = {}
+    for name in norms:
+        if name == 'H2':
+            values[name] = np.sqrt(np.sum(np.square(G), axis=(1,2,3)))
+        elif name == 'HInf':
+            values[name] = _hinf_norms(G, frequencies)
+        elif name == 'L1':
+            values[name] = np.max(np.sum(np.absolute(G), axis=(1,3)), axis=1)
+        else:
+            error_message('Unknown norm: %s' % name)
+    return values
+
+def _hinf_norms (G, frequencies=None):
+    # the frequency responses at the grid e^{j omega}, omega in [0, pi], by one real FFT of the taps,
+    # and the largest singular values at all frequencies by one batched SVD, one candidate at a time to bound the memory
+    # the transform is at least as long as the taps, a shorter one would drop the late taps
+    if frequencies is None:
+        frequencies = max(512, 16*G.shape[1])
+    n = max(2*(frequencies-1), G.shape[1])
+    peaks = np.zeros(G.shape[0])
+    for i in range(G.shape[0]):
+        response = np.fft.rfft(G[i], n=n, axis=0)
+        peaks[i] = np.max(np.linalg.svd(response, compute_uv=False)[:, 0])
+    return peaks
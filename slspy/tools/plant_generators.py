@@ -1,6 +1,9 @@
-from ..system_models import LTI_System
+from ..system_models import LTI_System, LTI_Ensemble_System
+from ..random_streams import as_generator
 from math import floor, ceil
 import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg
 
 '''
 Some helper functions to generate the LTI system plant matrices
@@ -44,24 +47,33 @@ def generate_matrices_from_ABCD (system_model=None, A=None, B=None, C=None, D=No
         system_model._D21 = D[Nz:Nz+Ny,0:Nw]
         system_model._D22 = D[Nz:Nz+Ny,Nw:Nw+Nu]
 
-def generate_BCD_and_zero_initialization (system_model=None):
+def generate_BCD_and_zero_initialization (system_model=None, sparse=False):
     # This function simply serves as an abbreviation
     # The user has to ensure that system_model is LTI_System
+    # sparse=True generates scipy.sparse (CSR) matrices
     system_model._Nw = system_model._Nx
     system_model._Nz = system_model._Nx + system_model._Nu
 
-    system_model._B1  = np.eye (system_model._Nx, system_model._Nw)
-    system_model._C1  = np.eye (system_model._Nz, system_model._Nx)
-    system_model._D12 = np.concatenate ((np.zeros([system_model._Nx, system_model._Nu]), np.eye(system_model._Nu)), axis = 0)
+    if sparse:
+        system_model._B1  = sp.eye (system_model._Nx, system_model._Nw, format='csr')
+        system_model._C1  = sp.eye (system_model._Nz, system_model._Nx, format='csr')
+        system_model._D12 = sp.eye (system_model._Nz, system_model._Nu, k=-system_model._Nx, format='csr')
+    else:
+        system_model._B1  = np.eye (system_model._Nx, system_model._Nw)
+        system_model._C1  = np.eye (system_model._Nz, system_model._Nx)
+        system_model._D12 = np.concatenate ((np.zeros([system_model._Nx, system_model._Nu]), np.eye(system_model._Nu)), axis = 0)
 
     if not system_model._state_feedback:
         # assign the matrices for y as well
-        system_model._C2  = np.eye(system_model._Ny, system_model._Nx)
+        if sparse:
+            system_model._C2  = sp.eye(system_model._Ny, system_model._Nx, format='csr')
+        else:
+            system_model._C2  = np.eye(system_model._Ny, system_model._Nx)
         #system_model._D22 = np.eye(system_model._Ny, system_model._Nu)
 
     system_model.initialize (x0 = np.zeros([system_model._Nx, 1]))
 
-def generate_doubly_stochastic_chain (system_model=None, rho=0, actuator_density=1, alpha=0):
+def generate_doubly_stochastic_chain (system_model=None, rho=0, actuator_density=1, alpha=0, sparse=False):
     '''
     Populates (A, B2) of the specified system with these dynamics:
     x_1(t+1) = rho*[(1-alpha)*x_1(t) + alpha x_2(t)] + B(1,1)u_1(t)
@@ -74,6 +86,7 @@ def generate_doubly_stochastic_chain (system_model=None, rho=0, actuator_density
        actuator_density : actuation density of B, in (0, 1]
                           this is approximate; only exact if things divide exactly
        alpha            : how much state is spread between neighbours
+       sparse           : generate scipy.sparse (CSR) matrices
     '''
     if not isinstance(system_model,LTI_System):
         # only modify LTI_System plant
@@ -86,20 +99,30 @@ def generate_doubly_stochastic_chain (system_model=None, rho=0, actuator_density
     Nu = int(ceil(Nx*actuator_density))
     system_model._Nu = Nu
 
-    system_model._A = (1-2*alpha)*np.eye(Nx)
-    system_model._A[0,0] += alpha
-    system_model._A[Nx-1,Nx-1] += alpha
-    tmp = alpha*np.eye(Nx-1)
-    system_model._A[0:-1,1:] += tmp
-    system_model._A[1:,0:-1] += tmp
-    system_model._A *= rho
-
-    system_model._B2 = np.zeros([Nx,Nu])
-    for i in range (Nu):
-        x = int(floor(i/actuator_density)) % Nx
-        system_model._B2[x,i] = 1
+    if sparse:
+        diagonal = (1-2*alpha)*np.ones(Nx)
+        diagonal[0] += alpha
+        diagonal[Nx-1] += alpha
+        off_diagonal = alpha*np.ones(Nx-1)
+        system_model._A = rho * sp.diags([off_diagonal, diagonal, off_diagonal], [-1, 0, 1], format='csr')
+    else:
+        system_model._A = (1-2*alpha)*np.eye(Nx)
+        system_model._A[0,0] += alpha
+        system_model._A[Nx-1,Nx-1] += alpha
+        tmp = alpha*np.eye(Nx-1)
+        system_model._A[0:-1,1:] += tmp
+        system_model._A[1:,0:-1] += tmp
+        system_model._A *= rho
+
+    rows = [int(floor(i/actuator_density)) % Nx for i in range (Nu)]
+    if sparse:
+        system_model._B2 = sp.csr_matrix((np.ones(Nu), (rows, np.arange(Nu))), shape=(Nx,Nu))
+    else:
+        system_model._B2 = np.zeros([Nx,Nu])
+        for i in range (Nu):
+            system_model._B2[rows[i],i] = 1
 
-def generate_random_chain (system_model=None, rho=1, actuator_density=1, random_seed=None):
+def generate_random_chain (system_model=None, rho=1, actuator_density=1, random_seed=None, sparse=False):
     '''
     Populates (A, B2) of the specified system with a random chain 
     (tridiagonal A matrix) and a random actuation (B) matrix
@@ -109,6 +132,9 @@ def generate_random_chain (system_model=None, rho=1, actuator_density=1, random_
        rho              : normalization value; A is generated s.t. max |eig(A)| = rho
        actuator_density : actuation density of B, in (0, 1]
                           this is approximate; only exact if things divide exactly
+       random_seed      : an int seeds the global numpy.random state (as before),
+                          a SeedSequence or Generator draws from its own stream and leaves the global state untouched
+       sparse           : generate scipy.sparse (CSR) matrices
     '''
     if not isinstance(system_model,LTI_System):
         # only modify LTI_System plant
@@ -117,27 +143,87 @@ def generate_random_chain (system_model=None, rho=1, actuator_density=1, random_
     if system_model._Nx == 0:
         return
 
-    if random_seed is not None:
-        np.random.seed(seed=random_seed)
+    if isinstance(random_seed, (np.random.SeedSequence, np.random.Generator)):
+        randn = as_generator(random_seed).standard_normal
+    else:
+        if random_seed is not None:
+            np.random.seed(seed=random_seed)
+        randn = np.random.randn
 
     Nx = system_model._Nx
     Nu = int(ceil(Nx*actuator_density))
     system_model._Nu = Nu
 
-    system_model._A = np.eye(Nx)
+    if sparse:
+        # the same random draws as the dense version
+        upper = randn(Nx-1) if Nx > 1 else np.zeros(0)
+        lower = randn(Nx-1) if Nx > 1 else np.zeros(0)
+        system_model._A = sp.diags([lower, np.ones(Nx), upper], [-1, 0, 1], format='csr')
+        if Nx > 2:
+            eigenvalues = scipy.sparse.linalg.eigs(system_model._A, k=1, which='LM', return_eigenvectors=False)
+        else:
+            eigenvalues = np.linalg.eigvals(system_model._A.toarray())
+    else:
+        system_model._A = np.eye(Nx)
 
-    if Nx > 1:
-        system_model._A[0:-1,1:] += np.diag(np.random.randn(Nx-1))
-        system_model._A[1:,0:-1] += np.diag(np.random.randn(Nx-1))
+        if Nx > 1:
+            system_model._A[0:-1,1:] += np.diag(randn(Nx-1))
+            system_model._A[1:,0:-1] += np.diag(randn(Nx-1))
 
-    eigenvalues, eigenvectors = np.linalg.eig(system_model._A)
+        eigenvalues, eigenvectors = np.linalg.eig(system_model._A)
     largest_eigenvalue = np.max(np.absolute(eigenvalues))
 
     # normalization
     system_model._A /= largest_eigenvalue
     system_model._A *= rho
 
-    system_model._B2 = np.zeros([Nx,Nu])
-    for i in range (Nu):
-        x = int(floor(i/actuator_density)) % Nx
-        system_model._B2[x,i] = np.random.randn ()
\ No newline at end of file
+    rows = [int(floor(i/actuator_density)) % Nx for i in range (Nu)]
+    values = [randn () for i in range (Nu)]
+    if sparse:
+        system_model._B2 = sp.csr_matrix((values, (rows, np.arange(Nu))), shape=(Nx,Nu))
+    else:
+        system_model._B2 = np.zeros([Nx,Nu])
+        for i in range (Nu):
+            system_model._B2[rows[i],i] = values[i]
+
+def generate_perturbed_ensemble (system_model=None, members=1, A_perturbation=0, B2_perturbation=0, random_seed=None):
+    '''
+    Returns an LTI_Ensemble_System of the specified system whose members perturb (A, B2)
+    Inputs
+       system_model    : LTI_System, the nominal plant
+       members         : the number of members
+       A_perturbation  : the standard deviation of the Gaussian perturbation of each nonzero entry of A
+       B2_perturbation : the standard deviation of the Gaussian perturbation of each nonzero entry of B2
+                         the perturbations keep the sparsity patterns, e.g., the chain structure
+       random_seed     : an int, SeedSequence, or Generator; None draws from the global numpy.random state
+    '''
+    if not isinstance(system_model,LTI_System):
+        return None
+
+    if not system_model.sanityCheck():
+        return None
+
+    rng = as_generator(random_seed)
+    randn = np.random.standard_normal if rng is None else rng.standard_normal
+
+    def perturb (matrix, scale):
+        # a stack of perturbed matrices, or the shared nominal matrix without perturbation
+        if scale == 0:
+            return matrix
+        dense = matrix.toarray() if sp.issparse(matrix) else np.asarray(matrix)
+        return dense + scale * randn((members,) + dense.shape) * (dense != 0)
+
+    ensemble = LTI_Ensemble_System(
+        Nx=system_model._Nx, Nw=system_model._Nw, Nu=system_model._Nu, Ny=system_model._Ny, Nz=system_model._Nz,
+        ignore_output=system_model._ignore_output, state_feedback=system_model._state_feedback
+    )
+    for name in LTI_System._matrices:
+        setattr(ensemble, name, getattr(system_model, name))
+    ensemble._A  = perturb(system_model._A,  A_perturbation)
+    ensemble._B2 = perturb(system_model._B2, B2_perturbation)
+    if ensemble.getMembers() != members:
+        # no perturbation, the members are copies of the nominal plant
+        A = ensemble._A.toarray() if sp.issparse(ensemble._A) else ensemble._A
+        ensemble._A = np.repeat(A[np.newaxis], members, axis=0)
+    ensemble._x0 = system_model._x0
+    return ensemble
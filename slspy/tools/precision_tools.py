@@ -0,0 +1,36 @@
+import copy
+import numpy as np
+
+'''
+Some helper functions to check the numerical precision of the simulations
+'''
+def check_dtype_accuracy (simulator=None, dtype=np.float32, reference_dtype=np.float64):
+    '''
+    Run the simulation in dtype and in reference_dtype with the same noise and compare the histories
+    Inputs
+    simulator       : the Simulator to check, each run uses a deep copy so the simulator is not changed
+    dtype           : the dtype under test, e.g., np.float32
+    reference_dtype : the dtype of the reference run
+    Outputs
+    errors          : a dict that maps 'x', 'y', 'z', 'u', 'w' to
+                      (maximum absolute error, maximum absolute error / maximum magnitude of the reference)
+    '''
+    # both runs draw the same random noise
+    random_state = np.random.get_state()
+
+    histories = []
+    for run_dtype in (dtype, reference_dtype):
+        np.random.set_state(random_state)
+        run_simulator = copy.deepcopy(simulator)
+        run_simulator.setDtype(run_dtype)
+        histories.append(run_simulator.run(preallocate=True))
+
+    errors = {}
+    for name, history, reference in zip(('x','y','z','u','w'), histories[0], histories[1]):
+        if (history is None) or (reference is None) or (reference.size == 0):
+            continue
+        absolute_error = np.max(np.absolute(history.astype(reference.dtype) - reference))
+        scale = np.max(np.absolute(reference))
+        errors[name] = (absolute_error, absolute_error / scale if scale > 0 else absolute_error)
+
+    return errors
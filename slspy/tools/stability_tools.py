@@ -0,0 +1,194 @@
+from ..core import error_message
+from ..system_models import LTI_System, LTI_Ensemble_System
+from ..random_streams import spawn_seeds
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+
+'''
+Stability screening of a synthesized controller against a family of (perturbed) plants,
+without simulating the noise response.
+
+With the plant
+    x(t+1) = A x(t) + B2 u(t),    y(t) = C2 x(t) + D22 u(t)
+and the controller realization
+    xi(t+1) = Ak xi(t) + Bk y(t),    u(t) = Ck xi(t) + Dk y(t)
+the closed loop s = [ x; xi ] evolves by
+    s(t+1) = A_cl s(t)
+and the plant is stabilized if the spectral radius of A_cl is below 1.
+The controller part of A_cl is built once and shared by all members.
+'''
+
+def screen_closed_loop_stability (system_model=None, controller=None, method='eig', chunk_size=16, workers=None, iterations=1000, random_seed=None):
+    '''
+    Compute the closed-loop spectral radius of each member of a plant family under one controller
+    Inputs
+       system_model : LTI_Ensemble_System (c.f. generate_perturbed_ensemble), LTI_System, or a list of LTI_System
+       controller   : a controller with a state-space realization, e.g., SLS_StateFeedback_FIR_Controller
+       method       : 'eig'   computes the eigenvalues of the dense closed-loop matrices, chunk_size members at a time
+                      'power' estimates the spectral radii by batched power iterations on the sparse realization,
+                              which needs no dense matrix but converges slowly if the leading eigenvalues are close
+                      remark: an SLS controller on its nominal plant gives a nilpotent A_cl,
+                              whose computed eigenvalues are only accurate to about eps^(1/FIR_horizon)
+       chunk_size   : the number of members processed together
+       workers      : the number of threads that process the chunks concurrently, None or 1 processes them sequentially
+       iterations   : the number of power iterations
+       random_seed  : the seed of the starting vectors of the power iterations
+    Outputs
+       a dict of
+         'spectral_radii'  : (members,) the closed-loop spectral radius of each member
+         'stable_fraction' : the fraction of the members with spectral radius below 1
+         'worst_margin'    : 1 - the largest spectral radius, negative if some member is unstable
+         'worst_member'    : the index of the member with the largest spectral radius
+    '''
+    if isinstance(system_model, (list, tuple)):
+        system_model = _stack_systems(system_model)
+    if not isinstance(system_model, LTI_System):
+        error_message('The plants must be LTI_System.')
+        return None
+    if not system_model.sanityCheck():
+        return None
+
+    realization = controller.getStateSpaceRealization() if controller is not None else None
+    if realization is None:
+        error_message('The controller has no state-space realization.')
+        return None
+    Ak, Bk, Ck, Dk = [sp.csr_matrix(matrix) for matrix in realization]
+
+    members = system_model.getMembers() if isinstance(system_model, LTI_Ensemble_System) else 1
+    plant = _plant_stacks(system_model)
+    if (Dk.shape[0] != plant['B2'].shape[2]) or (Dk.shape[1] != plant['C2'].shape[1]):
+        error_message('Dimension mismatch: the controller does not map y to u.')
+        return None
+
+    chunks = [np.arange(start, min(start+chunk_size, members)) for start in range(0, members, chunk_size)]
+    if method == 'eig':
+        screen = lambda i: _eig_radii(plant, (Ak, Bk, Ck, Dk), chunks[i])
+    elif method == 'power':
+        # one random stream per chunk, so the estimates do not depend on the workers
+        seeds = spawn_seeds(random_seed, len(chunks))
+        screen = lambda i: _power_radii(plant, (Ak, Bk, Ck, Dk), chunks[i], iterations, seeds[i])
+    else:
+        error_message('Unknown method: %s' % method)
+        return None
+
+    if (workers is None) or (workers <= 1):
+        radii = [screen(i) for i in range(len(chunks))]
+    else:
+        # the linear algebra releases the GIL
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            radii = list(executor.map(screen, range(len(chunks))))
+    radii = np.concatenate(radii)
+
+    return {
+        'spectral_radii': radii,
+        'stable_fraction': np.mean(radii < 1),
+        'worst_margin': 1 - np.max(radii),
+        'worst_member': int(np.argmax(radii))
+    }
+
+def _stack_systems (systems):
+    # the LTI_Ensemble_System whose members are the systems
+    for system in systems:
+        if not (isinstance(system, LTI_System) and system.sanityCheck()):
+            return None
+    first = systems[0]
+    ensemble = LTI_Ensemble_System(
+        Nx=first._Nx, Nw=first._Nw, Nu=first._Nu, Ny=first._Ny, Nz=first._Nz,
+        ignore_output=first._ignore_output, state_feedback=first._state_feedback
+    )
+    for name in LTI_System._matrices:
+        matrices = [getattr(system, name) for system in systems]
+        setattr(ensemble, name, np.stack([matrix.toarray() if sp.issparse(matrix) else matrix for matrix in matrices]))
+    return ensemble
+
+def _plant_stacks (system):
+    # the dense (members or 1, rows, columns) stacks of A, B2, C2, D22, y = x for a state-feedback plant
+    # the undefined matrices of an ensemble are the zero matrices of its members, c.f. LTI_Ensemble_System.normalize()
+    member = system.getMember(0) if isinstance(system, LTI_Ensemble_System) else system
+    member.sanityCheck()
+
+    def stack (name):
+        matrix = getattr(system, name)
+        if matrix is None:
+            matrix = getattr(member, name)
+        matrix = matrix.toarray() if sp.issparse(matrix) else np.asarray(matrix)
+        return matrix if matrix.ndim == 3 else matrix[np.newaxis]
+
+    Nx = system._Nx
+    Nu = member._Nu
+    if system._state_feedback:
+        C2  = np.eye(Nx)[np.newaxis]
+        D22 = np.zeros([1, Nx, Nu])
+    else:
+        C2  = stack('_C2')
+        D22 = stack('_D22')
+    return {'A': stack('_A'), 'B2': stack('_B2'), 'C2': C2, 'D22': D22}
+
+def _select (stack, chunk):
+    # the members of the chunk, a shared matrix stays shared
+    return stack if stack.shape[0] == 1 else stack[chunk]
+
+def _loop_gain (plant, Dk, chunk):
+    # M = (I - Dk D22)^{-1} of each member, u = M (Ck xi + Dk C2 x)
+    D22 = _select(plant['D22'], chunk)
+    Nu = D22.shape[2]
+    return np.linalg.inv(np.eye(Nu) - Dk.toarray() @ D22)
+
+def _eig_radii (plant, realization, chunk):
+    Ak, Bk, Ck, Dk = [matrix.toarray() for matrix in realization]
+    A, B2, C2, D22 = [_select(plant[name], chunk) for name in ('A', 'B2', 'C2', 'D22')]
+    M = _loop_gain(plant, realization[3], chunk)
+
+    K = max(stack.shape[0] for stack in (A, B2, C2, D22))
+    Nx  = A.shape[1]
+    Nxi = Ak.shape[0]
+
+    # u = K_s s, y = Y_s s
+    K_s = M @ np.concatenate([Dk @ C2, np.broadcast_to(Ck, (C2.shape[0],) + Ck.shape)], axis=2)
+    Y_s = np.concatenate([np.broadcast_to(C2, (K_s.shape[0],) + C2.shape[1:]), np.zeros([K_s.shape[0], C2.shape[1], Nxi])], axis=2) + D22 @ K_s
+
+    A_cl = np.zeros([K, Nx+Nxi, Nx+Nxi])
+    A_cl[:, :Nx, :Nx] = A
+    A_cl[:, Nx:, Nx:] = Ak
+    A_cl[:, :Nx] += B2 @ K_s
+    A_cl[:, Nx:] += Bk @ Y_s
+    radii = np.max(np.absolute(np.linalg.eigvals(A_cl)), axis=1)
+    return np.broadcast_to(radii, (len(chunk),)).copy()
+
+def _power_radii (plant, realization, chunk, iterations, seed):
+    # the k-th column of the signals belongs to the k-th member of the chunk
+    Ak, Bk, Ck, Dk = realization
+    A, B2, C2, D22 = [_select(plant[name], chunk) for name in ('A', 'B2', 'C2', 'D22')]
+    M = _loop_gain(plant, Dk, chunk)
+    apply = LTI_Ensemble_System._apply
+    if M.shape[0] == 1:
+        M = M[0]
+    A, B2, C2, D22 = [stack[0] if stack.shape[0] == 1 else stack for stack in (A, B2, C2, D22)]
+
+    K = len(chunk)
+    rng = np.random.default_rng(seed)
+    x  = rng.standard_normal([A.shape[-1], K])
+    xi = rng.standard_normal([Ak.shape[0], K])
+
+    # the growth rate is averaged over the last half of the iterations, which smooths complex eigenvalue pairs
+    log_growth = np.zeros(K)
+    averaged = 0
+    for t in range(iterations):
+        norm = np.sqrt(np.sum(np.square(x), axis=0) + np.sum(np.square(xi), axis=0))
+        vanished = norm == 0
+        norm[vanished] = 1
+        x  = x  / norm
+        xi = xi / norm
+
+        u = apply(M, Ck.dot(xi) + Dk.dot(apply(C2, x)))
+        y = apply(C2, x) + apply(D22, u)
+        x, xi = apply(A, x) + apply(B2, u), Ak.dot(xi) + Bk.dot(y)
+
+        if t >= iterations // 2:
+            growth = np.sqrt(np.sum(np.square(x), axis=0) + np.sum(np.square(xi), axis=0))
+            with np.errstate(divide='ignore'):
+                log_growth += np.log(growth)
+            averaged += 1
+
+    return np.exp(log_growth / max(averaged, 1))
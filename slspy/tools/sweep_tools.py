@@ -0,0 +1,224 @@
+from ..core import ObjBase, SystemModel, NoiseModel, Simulator
+from ..synthesis_algorithms import SLS
+from ..sls.components import SLS_Objective, SLS_Constraint
+from ..iop.components import IOP_Objective, IOP_Constraint
+from ..random_streams import spawn_seeds, spawn_generators
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import copy
+
+'''
+Parameter sweeps of synthesis + simulation studies over a process pool.
+
+A synthesizer holds cvxpy objects and cannot be pickled, so a sweep is described by a Sweep_Spec,
+a declarative (picklable) recipe that each worker rebuilds locally:
+
+    spec = Sweep_Spec(
+        system = sys,  # or a function that returns the system model, e.g., of parameters 'system.rho'
+        synthesis_kwargs = {'FIR_horizon': 10},
+        components = [
+            ('H2',         SLS_Obj_H2,          {}),
+            ('robust',     SLS_Cons_Robust,     {'gamma_coefficient': 10e3}),
+            ('dlocalized', SLS_Cons_dLocalized, {'act_delay': 1, 'd': 6})
+        ],
+        horizon = 25, noise = noise
+    )
+    results = run_sweep(spec, parameter_grid(**{'dlocalized.comm_speed': [2, 1, 0.4]}))
+
+A grid point maps '<name>.<keyword>' to a value, where <name> is the name of a component,
+or 'system', 'synthesis', 'solver', 'simulation' for the keyword arguments of the corresponding parts.
+'''
+
+def parameter_grid (**axes):
+    '''
+    The Cartesian product of the axes, e.g.,
+        parameter_grid(**{'dlocalized.d': [3, 6], 'dlocalized.comm_speed': [1, 2]})
+    returns the four grid points (dicts) in the row-major order
+    '''
+    names = list(axes.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[axes[name] for name in names])]
+
+class Sweep_Spec (ObjBase):
+    '''
+    A picklable description of a synthesis (+ simulation) problem
+    '''
+    def __init__ (self,
+        system=None,
+        system_kwargs=None,
+        synthesis=SLS,
+        synthesis_kwargs=None,
+        components=None,
+        solver_options=None,
+        horizon=None,
+        noise=None,
+        trajectories=None,
+        aggregators=None,
+        metrics=None,
+        keep_controllers=False
+    ):
+        '''
+        system           : a SystemModel, or a (module-level) function that returns one from system_kwargs
+        synthesis        : the synthesis algorithm class, e.g., SLS or IOP
+        components       : a list of (name, class, kwargs) of the objectives and constraints, added in order
+        solver_options   : the options of the solver, e.g., {'solver': 'ECOS'}
+        horizon          : the simulation horizon, None to build no simulator
+        noise            : a NoiseModel, or (class, kwargs)
+        trajectories     : the number of batched trajectories of the simulation
+        aggregators      : a list of (class, kwargs) of the aggregators of the simulation,
+                           the simulation is run only if there are aggregators
+        metrics          : a (module-level) function of (synthesizer, controller, simulator) that returns a dict,
+                           simulator is None if the horizon is None, and not run yet if there are no aggregators
+        keep_controllers : return the synthesized controllers as well
+        '''
+        self._system = system
+        self._system_kwargs = system_kwargs if system_kwargs is not None else {}
+        self._synthesis = synthesis
+        self._synthesis_kwargs = synthesis_kwargs if synthesis_kwargs is not None else {}
+        self._components = components if components is not None else []
+        self._solver_options = solver_options if solver_options is not None else {}
+        self._simulation_kwargs = {'horizon': horizon, 'trajectories': trajectories}
+        self._noise = noise
+        self._aggregators = aggregators if aggregators is not None else []
+        self._metrics = metrics
+        self._keep_controllers = keep_controllers
+
+    def __splitParameters (self, parameters):
+        # group the grid point by the parts it applies to
+        groups = {}
+        names = ['system', 'synthesis', 'solver', 'simulation'] + [name for name, cls, kwargs in self._components]
+        for key, value in parameters.items():
+            part, _, keyword = key.partition('.')
+            if (part not in names) or (keyword == ''):
+                self.errorMessage('Unknown parameter: %s' % key)
+                return None
+            groups.setdefault(part, {})[keyword] = value
+        return groups
+
+    def buildSystem (self, parameters=None):
+        groups = self.__splitParameters(parameters or {})
+        if groups is None:
+            return None
+        if isinstance(self._system, SystemModel):
+            # the parameters replace existing attributes of a copy of the system, e.g., 'system.Nx' sets _Nx
+            system = copy.deepcopy(self._system)
+            for keyword, value in groups.get('system', {}).items():
+                if not hasattr(system, '_'+keyword):
+                    self.errorMessage('Unknown system parameter: %s' % keyword)
+                    return None
+                setattr(system, '_'+keyword, value)
+            return system
+        kwargs = dict(self._system_kwargs)
+        kwargs.update(groups.get('system', {}))
+        return self._system(**kwargs)
+
+    def buildSynthesizer (self, system, parameters=None):
+        # return the synthesizer and the dict of its named components
+        groups = self.__splitParameters(parameters or {})
+        if groups is None:
+            return None, None
+
+        kwargs = dict(self._synthesis_kwargs)
+        kwargs.update(groups.get('synthesis', {}))
+        synthesizer = self._synthesis(system_model=system, **kwargs)
+
+        components = {}
+        for name, cls, component_kwargs in self._components:
+            component_kwargs = dict(component_kwargs)
+            component_kwargs.update(groups.get(name, {}))
+            components[name] = cls(**component_kwargs)
+            synthesizer += components[name]
+
+        solver_options = dict(self._solver_options)
+        solver_options.update(groups.get('solver', {}))
+        if solver_options and hasattr(synthesizer, 'getSolver'):
+            synthesizer.getSolver().setOptions(**solver_options)
+
+        return synthesizer, components
+
+    def buildSimulator (self, system, controller, parameters=None, seed=None):
+        # seed: the random stream(s) of the noise, one per trajectory in batched simulations
+        groups = self.__splitParameters(parameters or {})
+        if groups is None:
+            return None
+        kwargs = dict(self._simulation_kwargs)
+        kwargs.update(groups.get('simulation', {}))
+        if kwargs.get('horizon') is None:
+            return None
+
+        noise = self._noise
+        if isinstance(noise, NoiseModel):
+            noise = copy.deepcopy(noise)
+        elif noise is not None:
+            cls, noise_kwargs = noise
+            noise = cls(**noise_kwargs)
+        if (noise is not None) and (seed is not None):
+            trajectories = kwargs.get('trajectories')
+            noise.setRandomGenerator(seed if trajectories is None else spawn_generators(seed, trajectories))
+        return Simulator(system=system, controller=controller, noise=noise, **kwargs)
+
+    def evaluate (self, parameters=None, seed=None):
+        # synthesize (and simulate) at one grid point, return a dict of the results
+        # seed: the random stream of the simulation noise, c.f. random_streams
+        parameters = parameters or {}
+        result = {
+            'parameters': parameters,
+            'objective_value': None,
+            'objective_values': {},
+            'stability_margins': {},
+            'aggregators': None,
+            'metrics': None
+        }
+
+        if self.__splitParameters(parameters) is None:
+            return result
+
+        system = self.buildSystem(parameters)
+        if system is None:
+            return result
+        synthesizer, components = self.buildSynthesizer(system, parameters)
+
+        controller = synthesizer.synthesizeControllerModel()
+        result['objective_value'] = synthesizer.getOptimalObjectiveValue()
+        for name, component in components.items():
+            if hasattr(component, 'getStabilityMargin'):
+                result['stability_margins'][name] = component.getStabilityMargin()
+            elif isinstance(component, (SLS_Objective, IOP_Objective)) and not isinstance(component, (SLS_Constraint, IOP_Constraint)):
+                result['objective_values'][name] = component.getObjectiveValue()
+        if self._keep_controllers:
+            result['controller'] = controller
+        if controller is None:
+            return result
+
+        simulator = self.buildSimulator(system, controller, parameters, seed=seed)
+        if (simulator is not None) and self._aggregators:
+            aggregators = [cls(**kwargs) for cls, kwargs in self._aggregators]
+            result['aggregators'] = simulator.run(aggregators=aggregators)
+
+        if self._metrics is not None:
+            result['metrics'] = self._metrics(synthesizer, controller, simulator)
+
+        return result
+
+def _evaluate_grid_point (spec, parameters, seed):
+    return spec.evaluate(parameters, seed=seed)
+
+def run_sweep (spec=None, grid=None, processes=None, seed=None):
+    '''
+    Evaluate the spec at each grid point over a process pool
+    Inputs
+    spec      : Sweep_Spec
+    grid      : a list of grid points (dicts), c.f. parameter_grid()
+    processes : the number of worker processes, None for the number of CPUs, 1 to run in this process
+    seed      : grid point k simulates with the k-th stream spawned from seed,
+                so the results do not depend on the number of processes
+    Outputs
+    results   : a list of the results of Sweep_Spec.evaluate(), in the order of the grid
+    '''
+    if grid is None:
+        grid = [{}]
+    seeds = [None] * len(grid) if seed is None else spawn_seeds(seed, len(grid))
+    if processes == 1:
+        return [spec.evaluate(parameters, seed=point_seed) for parameters, point_seed in zip(grid, seeds)]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_evaluate_grid_point, [spec] * len(grid), grid, seeds))
@@ -5,6 +5,13 @@ import numpy as np
 def matrix_list_multiplication (matrix_A=None, list_B=None):
     if list_B is None:
         list_B = []
+    if isinstance(list_B, np.ndarray):
+        # preallocated histories
+        if list_B.ndim == 2:
+            # (horizon, dimension)
+            return np.dot(list_B, matrix_A.T)
+        # (horizon, dimension, trajectories)
+        return np.matmul(matrix_A, list_B)
     AB = []
     for t in range(len(list_B)):
         AB.append(np.dot(matrix_A,list_B[t]))
@@ -17,7 +24,8 @@ def plot_heat_map (x=None, Bu=None, myTitle='title', outputFileName=None, left_t
     '''
     Plots log-based heat map for x, u
     Inputs
-    x, Bu    : state and actuation values at nodes
+    x, Bu    : state and actuation values at nodes, either lists of column vectors
+               or (horizon, dimension) arrays
     myTitle  : overall title of the heat maps
     '''
 
@@ -27,8 +35,13 @@ def plot_heat_map (x=None, Bu=None, myTitle='title', outputFileName=None, left_t
     logmin = -4
     logmax = 0
 
-    plt_x  = np.asarray(np.concatenate(x, axis=1))
-    plt_Bu = np.asarray(np.concatenate(Bu,axis=1))
+    def to_space_time (history):
+        if isinstance(history, np.ndarray):
+            return history.T
+        return np.asarray(np.concatenate(history, axis=1))
+
+    plt_x  = to_space_time(x)
+    plt_Bu = to_space_time(Bu)
 
     np.seterr(divide = 'ignore') 
     plt_x  = np.log10(np.absolute(plt_x))